@@ -1,11 +1,17 @@
+import os
 import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 from sklearn.cluster import DBSCAN
 import time
+import heapq
+import uuid
+import threading
+from collections import OrderedDict
 from Similarity_Algorithm import find_similar_activities, fetch_low_cost_activities
-from route import fetch_distance_matrix, cluster_locations
-from hotel_suggestions import suggest_hotels
+from route import fetch_distance_matrix, cluster_locations, order_stops, ROUTE_OPT_BUDGET_MS
+from hotel_suggestions import suggest_hotels, load_hotels, HotelIndex
+from profiling import stage, record_sizes
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -16,13 +22,78 @@ MAX_HOURS_PER_DAY = 10.0
 TAXI_RATE = 16.0
 MAX_TRAVEL_TIME = 5.0
 MAX_ACTIVITIES_PER_DAY = 3
+SCORE_WEIGHTS = {"similarity": 0.5, "rating": 0.3, "cost": 0.2}
 
-def score_activity(activity, daily_budget_per_person):
+# Itinerary variants a request can ask for by name; each field can be overridden per request
+VARIANT_PRESETS = {
+    "budget": {"weights": {"similarity": 0.3, "rating": 0.2, "cost": 0.5}, "budgetMultiplier": 0.6, "maxActivitiesPerDay": 3},
+    "balanced": {"weights": SCORE_WEIGHTS, "budgetMultiplier": 1.0, "maxActivitiesPerDay": 3},
+    "premium": {"weights": {"similarity": 0.4, "rating": 0.6, "cost": 0.0}, "budgetMultiplier": 1.0, "maxActivitiesPerDay": 4}
+}
+MAX_VARIANTS = int(os.getenv("MAX_VARIANTS", "5"))
+
+# Pipeline state of recent itineraries, kept for re-planning single days
+PLAN_CACHE_SIZE = int(os.getenv("PLAN_CACHE_SIZE", "256"))
+PLAN_CACHE_TTL = float(os.getenv("PLAN_CACHE_TTL", "3600"))
+_plan_cache = OrderedDict()
+_plan_cache_lock = threading.Lock()
+
+def score_activity(activity, daily_budget_per_person, weights=SCORE_WEIGHTS):
     similarity = activity["similarity_score"]
     rating = activity["rating"]
     cost = activity["activity"]["estimatedCost"]
     cost_score = 1.0 - min(cost / daily_budget_per_person, 1.0)
-    return 0.5 * similarity + 0.3 * rating / 5.0 + 0.2 * cost_score
+    return weights["similarity"] * similarity + weights["rating"] * rating / 5.0 + weights["cost"] * cost_score
+
+def resolve_variants(trip):
+    """
+    Settings of the variants requested by a trip's "variants" option, or None without one.
+
+    The option is a number of presets (taken in VARIANT_PRESETS order) or a list of preset
+    names and dicts {"name", "preset", "weights", "budget" | "budgetMultiplier", "maxActivitiesPerDay"}.
+    Budgets derived from a multiplier are raised to MINIMUM_BUDGET; explicit ones must reach it.
+    """
+    requested = trip.get("variants")
+    if requested is None or requested is False or requested == []:
+        return None
+    if isinstance(requested, int) and not isinstance(requested, bool):
+        if not 1 <= requested <= len(VARIANT_PRESETS):
+            raise ValueError(f"variants must be between 1 and {len(VARIANT_PRESETS)} when given as a number")
+        requested = list(VARIANT_PRESETS)[:requested]
+    if not isinstance(requested, list) or len(requested) > MAX_VARIANTS:
+        raise ValueError(f"variants must be a list of at most {MAX_VARIANTS} presets or variant settings")
+
+    variants = []
+    for v in requested:
+        if isinstance(v, str):
+            v = {"preset": v}
+        if not isinstance(v, dict):
+            raise ValueError(f"Invalid variant: {v}")
+        if not all(isinstance(v.get(key, ""), str) for key in ("name", "preset")):
+            raise ValueError(f"Invalid variant: name and preset must be strings ({v})")
+        preset_name = v.get("preset", v.get("name") if v.get("name") in VARIANT_PRESETS else "balanced")
+        if preset_name not in VARIANT_PRESETS:
+            raise ValueError(f"Unknown variant preset '{preset_name}', expected one of {list(VARIANT_PRESETS)}")
+        preset = VARIANT_PRESETS[preset_name]
+        if not isinstance(v.get("weights") or {}, dict):
+            raise ValueError(f"Invalid variant '{v.get('name', preset_name)}': weights must be an object")
+        weights = dict(preset["weights"])
+        weights.update(v.get("weights") or {})
+        if set(weights) != set(SCORE_WEIGHTS):
+            raise ValueError(f"Invalid variant '{v.get('name', preset_name)}': weights must be {list(SCORE_WEIGHTS)}")
+        try:
+            weights = {k: float(weights[k]) for k in SCORE_WEIGHTS}
+            if "budget" in v:
+                budget = float(v["budget"])
+            else:
+                budget = max(float(trip["budget"]) * float(v.get("budgetMultiplier", preset["budgetMultiplier"])), MINIMUM_BUDGET)
+            max_activities = int(v.get("maxActivitiesPerDay", preset["maxActivitiesPerDay"]))
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid variant '{v.get('name', preset_name)}': {e}")
+        if min(weights.values()) < 0 or budget < MINIMUM_BUDGET or max_activities < 1:
+            raise ValueError(f"Invalid variant '{v.get('name', preset_name)}': negative weight, budget too low or no activities per day")
+        variants.append({"name": str(v.get("name", preset_name)), "weights": weights, "budget": budget, "maxActivitiesPerDay": max_activities})
+    return variants
 
 def assign_time_slot(start_time, duration):
     start_str = start_time.strftime("%H:%M")
@@ -40,19 +111,203 @@ def format_travel_duration(travel_time):
     else:
         return f"{minutes} min"
 
-def convert_to_serializable(data):
-    if isinstance(data, dict):
-        return {k: convert_to_serializable(v) for k, v in data.items()}
-    elif isinstance(data, list):
-        return [convert_to_serializable(item) for item in data]
-    elif isinstance(data, (np.integer, np.int64)):
-        return int(data)
-    elif isinstance(data, (np.floating, np.float64)):
-        return float(data)
-    return data
+class FallbackSelector:
+    """
+    Returns the next feasible fallback activity for a day without rescanning the pool.
 
-def generate_itinerary(user_input):
-    start_time = time.time()
+    Candidates are kept in cost order (the order fetch_low_cost_activities returns them in),
+    grouped by duration. Within a group the first unused candidate is also the cheapest, so
+    it is the only one that needs a budget check; a skip-pointer array over each group acts
+    as the used bitmap and jumps over consumed candidates. Picks are the same as scanning
+    the pool from the start and taking the first unused activity that fits.
+    """
+
+    def __init__(self, fallback_activities, people):
+        self.pool = sorted(fallback_activities, key=lambda a: float(a["activity"]["estimatedCost"]))
+        self.groups = {}
+        self.slots = {}
+        for position, activity in enumerate(self.pool):
+            dur = float(activity.get("duration", 2))
+            group = self.groups.setdefault(dur, {"costs": [], "positions": []})
+            self.slots.setdefault(activity["activity"]["name"], []).append((dur, len(group["costs"])))
+            group["costs"].append(float(activity["activity"]["estimatedCost"]) * people)
+            group["positions"].append(position)
+        for group in self.groups.values():
+            # next_unused[k] == k while candidate k is unused; the last slot is a sentinel
+            group["next_unused"] = list(range(len(group["costs"]) + 1))
+
+    @staticmethod
+    def _first_unused(next_unused, k):
+        root = k
+        while next_unused[root] != root:
+            root = next_unused[root]
+        while next_unused[k] != root:
+            next_unused[k], k = root, next_unused[k]
+        return root
+
+    def mark_used(self, name):
+        """Exclude every candidate with this name from future picks."""
+        for dur, k in self.slots.get(name, []):
+            self.groups[dur]["next_unused"][k] = k + 1
+
+    def next_feasible(self, daily_cost, daily_budget, daily_duration, max_hours, skip=()):
+        """
+        Return (activity, total cost) of the first unused candidate that fits, or None.
+        Candidates named in skip (rejected for the current day only) are passed over.
+        """
+        best = None
+        for dur, group in self.groups.items():
+            if daily_duration + dur > max_hours:
+                continue
+            k = self._first_unused(group["next_unused"], 0)
+            while k < len(group["costs"]) and self.pool[group["positions"][k]]["activity"]["name"] in skip:
+                k = self._first_unused(group["next_unused"], k + 1)
+            if k == len(group["costs"]) or daily_cost + group["costs"][k] > daily_budget:
+                continue
+            if best is None or group["positions"][k] < best[0]:
+                best = (group["positions"][k], group["costs"][k])
+        if best is None:
+            return None
+        return self.pool[best[0]], best[1]
+
+class ClusterScheduler:
+    """
+    Tracks the remaining candidate activities per cluster and picks each day's cluster.
+
+    Every cluster keeps its members sorted by score, a running score sum and a count of
+    unused members. Clusters sit in a max-heap keyed by their remaining average score;
+    consuming an activity pushes its cluster's updated average and outdated heap entries
+    are skipped when popped, so exhausted clusters drop out instead of being rescanned.
+    """
+
+    def __init__(self, activities):
+        self.used = set()
+        self.by_name = {}
+        self.members = {}
+        self.cursor = {}
+        self.score_sum = {}
+        self.remaining = {}
+        self.version = {}
+        self.order = {}
+        for act in activities:
+            self.by_name.setdefault(act["activity"]["name"], []).append(act)
+            cid = act.get("cluster_id", -1)
+            if cid == -1:
+                continue
+            self.order.setdefault(cid, len(self.order))
+            self.members.setdefault(cid, []).append(act)
+            self.score_sum[cid] = self.score_sum.get(cid, 0.0) + act["score"]
+            self.remaining[cid] = self.remaining.get(cid, 0) + 1
+        for members in self.members.values():
+            members.sort(key=lambda x: x["score"], reverse=True)
+        # Noise points are only scheduled once every cluster is exhausted
+        self.all_members = sorted(activities, key=lambda x: x["score"], reverse=True)
+        self.heap = []
+        for cid in self.members:
+            self.version[cid] = 0
+            self._push(cid)
+
+    def _push(self, cid):
+        # Rounded so that drift in the running sum cannot reorder tied clusters
+        avg = round(self.score_sum[cid] / self.remaining[cid], 9)
+        heapq.heappush(self.heap, (-avg, self.order[cid], self.version[cid], cid))
+
+    def _take(self, key, members, limit):
+        start = self.cursor.get(key, 0)
+        while start < len(members) and members[start]["id"] in self.used:
+            start += 1
+        self.cursor[key] = start
+        picked = []
+        for act in members[start:]:
+            if len(picked) == limit:
+                break
+            if act["id"] not in self.used:
+                picked.append(act)
+        return picked
+
+    def best_cluster(self):
+        """Cluster with the highest average score among its unused members, or None."""
+        while self.heap:
+            _, _, version, cid = self.heap[0]
+            if version == self.version[cid] and self.remaining[cid] > 0:
+                return cid
+            heapq.heappop(self.heap)
+        return None
+
+    def day_candidates(self, limit):
+        """Best remaining activities (by score) of the best cluster, or of all activities once clusters run out."""
+        cid = self.best_cluster()
+        if cid is None:
+            return self._take("all", self.all_members, limit)
+        return self._take(cid, self.members[cid], limit)
+
+    def mark_used(self, name):
+        """Consume every candidate activity with this name."""
+        for act in self.by_name.get(name, []):
+            if act["id"] in self.used:
+                continue
+            self.used.add(act["id"])
+            cid = act.get("cluster_id", -1)
+            if cid == -1:
+                continue
+            self.score_sum[cid] -= act["score"]
+            self.remaining[cid] -= 1
+            self.version[cid] += 1
+            if self.remaining[cid] > 0:
+                self._push(cid)
+
+def store_plan(state):
+    """Cache a pipeline state and return its itinerary token."""
+    token = uuid.uuid4().hex
+    with _plan_cache_lock:
+        _plan_cache[token] = (time.time(), state)
+        while len(_plan_cache) > PLAN_CACHE_SIZE:
+            _plan_cache.popitem(last=False)
+    return token
+
+def load_plan(token):
+    """Return the cached pipeline state of an itinerary token."""
+    if not isinstance(token, str):
+        raise ValueError("Unknown or expired itinerary token")
+    with _plan_cache_lock:
+        cached = _plan_cache.get(token)
+        if not cached or time.time() - cached[0] > PLAN_CACHE_TTL:
+            _plan_cache.pop(token, None)
+            raise ValueError("Unknown or expired itinerary token")
+        _plan_cache.move_to_end(token)
+        return cached[1]
+
+def has_plan(token):
+    """Whether an itinerary token can still be re-planned (cached and not expired)."""
+    with _plan_cache_lock:
+        cached = _plan_cache.get(token)
+        return cached is not None and time.time() - cached[0] <= PLAN_CACHE_TTL
+
+def make_entry(activity, cost, dur, current_time, day, start_date):
+    start_str, end_str = assign_time_slot(current_time, dur)
+    return {
+        "name": activity["activity"]["name"],
+        "category": activity["activity"]["category"],
+        "location": activity["activity"]["location"],
+        "time_slot": f"{start_str}-{end_str}",
+        "duration": format_travel_duration(dur),
+        "estimatedCost": cost,
+        "rating": float(activity["rating"]),
+        "latitude": float(activity["activity"]["latitude"]),
+        "longitude": float(activity["activity"]["longitude"]),
+        "day": day,
+        "date": (start_date + timedelta(days=day - 1)).strftime("%Y-%m-%d")
+    }
+
+def prepare_trip(user_input, candidate_budget=None, warm_only=False):
+    """
+    Run the stages shared by every day: catalog lookup, distance matrix, clustering,
+    scoring and hotel lookup. Returns the pipeline state, or None without candidates.
+
+    candidate_budget (default: the trip budget) is the budget candidates are fetched for,
+    the largest one when several variants are planned from the same state. With warm_only,
+    only the cached stages run (up to clustering) and None is returned.
+    """
     start_date = datetime.strptime(user_input["trip"]["startDate"], "%Y-%m-%d")
     end_date = datetime.strptime(user_input["trip"]["endDate"], "%Y-%m-%d")
     days = (end_date - start_date).days + 1
@@ -65,8 +320,10 @@ def generate_itinerary(user_input):
         raise ValueError("Invalid trip inputs: days, people, or budget too low")
 
     daily_budget = budget / days
-    activities = find_similar_activities(destination, preferences, budget, people, days)
-    fallback_activities = fetch_low_cost_activities(destination, budget, people, 50)
+    with stage("candidates"):
+        candidate_budget = candidate_budget or budget
+        activities = find_similar_activities(destination, preferences, candidate_budget, people, days)
+        fallback_activities = fetch_low_cost_activities(destination, candidate_budget, people, 50)
 
     valid_activities, locations = [], []
     coord_to_activity = {}
@@ -84,15 +341,20 @@ def generate_itinerary(user_input):
         locations.append(coord)
 
     if not valid_activities:
-        return {"itinerary": []}
+        return None
 
-    distance_matrix, time_matrix, valid_indices = fetch_distance_matrix(locations)
+    with stage("distance_matrix"):
+        distance_matrix, time_matrix, valid_indices = fetch_distance_matrix(locations)
+    record_sizes(candidates=len(activities), fallback_candidates=len(fallback_activities), matrix_n=len(valid_indices), days=days)
     valid_activities = [valid_activities[i] for i in valid_indices]
     for i, act in enumerate(valid_activities):
         act["matrix_index"] = i
         act["id"] = i
 
-    clusters = cluster_locations(distance_matrix, eps_km=5.0, min_samples=2)
+    with stage("clustering"):
+        clusters = cluster_locations(distance_matrix, eps_km=5.0, min_samples=2, sanitized=True)
+    if warm_only:
+        return None
     for i, cluster_id in enumerate(clusters):
         valid_activities[i]["cluster_id"] = cluster_id
     logger.info(f"Cluster sizes: {[np.sum(clusters == c) for c in np.unique(clusters) if c >= 0]}")
@@ -100,137 +362,284 @@ def generate_itinerary(user_input):
     for act in valid_activities:
         act["score"] = score_activity(act, daily_budget / people)
 
-    cluster_groups = {}
+    matrix_index_by_name = {}
     for act in valid_activities:
-        cid = act.get("cluster_id", -1)
-        cluster_groups.setdefault(cid, []).append(act)
+        matrix_index_by_name.setdefault(act["activity"]["name"], act["matrix_index"])
 
-    itinerary = []
-    used_ids = set()
-    used_names_global = set()
+    with stage("hotels"):
+        hotels = HotelIndex(load_hotels(destination))
+
+    return {
+        "trip": user_input["trip"],
+        "start_date": start_date,
+        "days": days,
+        "people": people,
+        "daily_budget": daily_budget,
+        "max_activities": MAX_ACTIVITIES_PER_DAY,
+        "activities": valid_activities,
+        "fallback_activities": fallback_activities,
+        "distance_matrix": distance_matrix,
+        "time_matrix": time_matrix,
+        "matrix_index_by_name": matrix_index_by_name,
+        "hotels": hotels,
+        "itinerary": []
+    }
+
+def schedule_day(state, day, daily_budget, cluster_scheduler, fallback_selector, used_names, required=(),
+                 max_activities=MAX_ACTIVITIES_PER_DAY, opt_budget_ms=ROUTE_OPT_BUDGET_MS):
+    """
+    Pick up to max_activities activities for a day: required ones first, then the best remaining
+    cluster's, then fallbacks. Picked names are added to used_names and consumed from both selectors.
+
+    Travel time between the day's stops (in their optimized order) counts against
+    MAX_HOURS_PER_DAY; the returned entries are in the order that was checked when the
+    last stop was accepted. opt_budget_ms bounds the CPU time spent ordering stops for the day.
+    """
+    people = state["people"]
+    deadline = time.thread_time() + opt_budget_ms / 1000
+    current_time = datetime.strptime("09:00", "%H:%M")
+    daily_cost, daily_duration, travel_hours = 0.0, 0.0, 0.0
+    day_entries = []
+    route = []  # matrix indices of the day's stops that have one
+    route_order = []  # visiting order of route, as checked against MAX_HOURS_PER_DAY
 
-    for day in range(1, days + 1):
-        current_time = datetime.strptime("09:00", "%H:%M")
-        daily_cost, daily_duration = 0.0, 0.0
-        day_entries = []
+    def travel_with(a):
+        idx = state["matrix_index_by_name"].get(a["activity"]["name"])
+        if idx is None:
+            return travel_hours, None
+        order, travel = order_stops(state["time_matrix"], route + [idx], deadline)
+        return travel, (idx, order)
 
-        available_clusters = [cid for cid in cluster_groups if cluster_groups[cid] and cid != -1]
-        if available_clusters:
-            cluster_scores = [(cid, sum(a["score"] for a in cluster_groups[cid]) / len(cluster_groups[cid])) for cid in available_clusters]
-            cluster_id = max(cluster_scores, key=lambda x: x[1])[0]
-            day_activities = [a for a in cluster_groups[cluster_id] if a["id"] not in used_ids and a["activity"]["name"] not in used_names_global]
-        else:
-            day_activities = [a for a in valid_activities if a["id"] not in used_ids and a["activity"]["name"] not in used_names_global]
+    def add(a, cost, dur, travel, stop):
+        nonlocal daily_cost, daily_duration, travel_hours, current_time
+        day_entries.append(make_entry(a, cost, dur, current_time, day, state["start_date"]))
+        used_names.add(a["activity"]["name"])
+        cluster_scheduler.mark_used(a["activity"]["name"])
+        fallback_selector.mark_used(a["activity"]["name"])
+        daily_cost += cost
+        daily_duration += dur
+        travel_hours = travel
+        if stop is not None:
+            route.append(stop[0])
+            route_order[:] = stop[1]
+        current_time += timedelta(hours=dur)
 
-        day_activities.sort(key=lambda x: x["score"], reverse=True)
+    for a in required:
+        if a["activity"]["name"] in used_names:
+            continue
+        cost = float(a["activity"]["estimatedCost"]) * people
+        dur = float(a.get("duration", 2))
+        travel, stop = travel_with(a)
+        if daily_cost + cost > daily_budget or daily_duration + dur + travel > MAX_HOURS_PER_DAY:
+            raise ValueError(f"'{a['activity']['name']}' does not fit the day's budget or hours")
+        add(a, cost, dur, travel, stop)
+
+    for a in cluster_scheduler.day_candidates(max_activities - len(day_entries)):
+        if a["activity"]["name"] in used_names:
+            continue
+        cost = float(a["activity"]["estimatedCost"]) * people
+        dur = float(a.get("duration", 2))
+        if daily_cost + cost <= daily_budget and daily_duration + dur + travel_hours <= MAX_HOURS_PER_DAY:
+            travel, stop = travel_with(a)
+            if daily_duration + dur + travel <= MAX_HOURS_PER_DAY:
+                add(a, cost, dur, travel, stop)
 
-        for a in day_activities[:MAX_ACTIVITIES_PER_DAY]:
-            if a["activity"]["name"] in used_names_global:
+    # day_entries holds no Travel entries yet
+    too_far = set()
+    while len(day_entries) < max_activities:
+        pick = fallback_selector.next_feasible(daily_cost, daily_budget, daily_duration + travel_hours, MAX_HOURS_PER_DAY, too_far)
+        if pick is None:
+            break
+        fallback, cost = pick
+        dur = float(fallback.get("duration", 2))
+        travel, stop = travel_with(fallback)
+        if daily_duration + dur + travel > MAX_HOURS_PER_DAY:
+            # Too far from the day's stops; skip it for this day and try the next feasible one
+            too_far.add(fallback["activity"]["name"])
+            continue
+        add(fallback, cost, dur, travel, stop)
+
+    # Visit the routable stops in the checked order; stops without a matrix index go last
+    routable = [e for e in day_entries if e["name"] in state["matrix_index_by_name"]]
+    others = [e for e in day_entries if e["name"] not in state["matrix_index_by_name"]]
+    return [routable[k] for k in route_order] + others
+
+def build_day_plan(state, day, day_entries):
+    """Lay out a day's activities with the travel legs between them."""
+    people = state["people"]
+    date = (state["start_date"] + timedelta(days=day - 1)).strftime("%Y-%m-%d")
+    new_entries = []
+    current_time = datetime.strptime("09:00", "%H:%M")
+    for i, entry in enumerate(day_entries):
+        dur = float(entry["duration"].split()[0]) if "hr" in entry["duration"] else float(entry["duration"].split()[0]) / 60
+        start_str, end_str = assign_time_slot(current_time, dur)
+        entry["time_slot"] = f"{start_str}-{end_str}"
+        new_entries.append(entry)
+        current_time += timedelta(hours=dur)
+
+        if i < len(day_entries) - 1:
+            next_entry = day_entries[i + 1]
+            idx_from = state["matrix_index_by_name"].get(entry["name"], -1)
+            idx_to = state["matrix_index_by_name"].get(next_entry["name"], -1)
+            if idx_from == -1 or idx_to == -1:
                 continue
-            cost = float(a["activity"]["estimatedCost"]) * people
-            dur = float(a.get("duration", 2))
-            if daily_cost + cost <= daily_budget and daily_duration + dur <= MAX_HOURS_PER_DAY:
-                start_str, end_str = assign_time_slot(current_time, dur)
-                entry = {
-                    "name": a["activity"]["name"],
-                    "category": a["activity"]["category"],
-                    "location": a["activity"]["location"],
-                    "time_slot": f"{start_str}-{end_str}",
-                    "duration": format_travel_duration(dur),
-                    "estimatedCost": cost,
-                    "rating": float(a["rating"]),
-                    "latitude": float(a["activity"]["latitude"]),
-                    "longitude": float(a["activity"]["longitude"]),
-                    "day": day,
-                    "date": (start_date + timedelta(days=day - 1)).strftime("%Y-%m-%d")
-                }
-                day_entries.append(entry)
-                used_ids.add(a["id"])
-                used_names_global.add(a["activity"]["name"])
-                daily_cost += cost
-                daily_duration += dur
-                current_time += timedelta(hours=dur)
-
-        if len([a for a in day_entries if a["category"] != "Travel"]) < MAX_ACTIVITIES_PER_DAY:
-            for fallback in fallback_activities:
-                if fallback["activity"]["name"] in used_names_global:
-                    continue
-                cost = float(fallback["activity"]["estimatedCost"]) * people
-                dur = float(fallback.get("duration", 2))
-                if daily_cost + cost <= daily_budget and daily_duration + dur <= MAX_HOURS_PER_DAY:
-                    start_str, end_str = assign_time_slot(current_time, dur)
-                    entry = {
-                        "name": fallback["activity"]["name"],
-                        "category": fallback["activity"]["category"],
-                        "location": fallback["activity"]["location"],
-                        "time_slot": f"{start_str}-{end_str}",
-                        "duration": format_travel_duration(dur),
-                        "estimatedCost": cost,
-                        "rating": float(fallback["rating"]),
-                        "latitude": float(fallback["activity"]["latitude"]),
-                        "longitude": float(fallback["activity"]["longitude"]),
-                        "day": day,
-                        "date": (start_date + timedelta(days=day - 1)).strftime("%Y-%m-%d")
-                    }
-                    day_entries.append(entry)
-                    used_names_global.add(fallback["activity"]["name"])
-                    daily_cost += cost
-                    daily_duration += dur
-                    current_time += timedelta(hours=dur)
-                if len([a for a in day_entries if a["category"] != "Travel"]) >= MAX_ACTIVITIES_PER_DAY:
-                    break
-
-        # Recompute travel between activities
-        new_entries = []
-        current_time = datetime.strptime("09:00", "%H:%M")
-        for i, entry in enumerate(day_entries):
-            dur = float(entry["duration"].split()[0]) if "hr" in entry["duration"] else float(entry["duration"].split()[0]) / 60
-            start_str, end_str = assign_time_slot(current_time, dur)
-            entry["time_slot"] = f"{start_str}-{end_str}"
-            new_entries.append(entry)
-            current_time += timedelta(hours=dur)
-
-            if i < len(day_entries) - 1:
-                next_entry = day_entries[i + 1]
-                idx_from = next((a["matrix_index"] for a in valid_activities if a["activity"]["name"] == entry["name"]), -1)
-                idx_to = next((a["matrix_index"] for a in valid_activities if a["activity"]["name"] == next_entry["name"]), -1)
-                if idx_from == -1 or idx_to == -1:
-                    continue
-                dist_km = float(distance_matrix[idx_from][idx_to])
-                time_hr = float(time_matrix[idx_from][idx_to])
-                travel_cost = dist_km * people * TAXI_RATE
-                start_str, end_str = assign_time_slot(current_time, time_hr)
-                travel = {
-                    "name": f"Travel to {next_entry['name']}",
-                    "category": "Travel",
-                    "location": f"Travel from {entry['name']} to {next_entry['name']}",
-                    "distance": round(dist_km, 2),
-                    "distanceUnit": "km",
-                    "duration": format_travel_duration(time_hr),
-                    "estimatedCost": round(travel_cost, 2),
-                    "time_slot": f"{start_str}-{end_str}",
-                    "rating": 0.0,
-                    "latitude": next_entry["latitude"],
-                    "longitude": next_entry["longitude"],
-                    "day": day,
-                    "date": (start_date + timedelta(days=day - 1)).strftime("%Y-%m-%d")
-                }
-                new_entries.append(travel)
-                current_time += timedelta(hours=time_hr)
-
-        itinerary.append({
-            "day": day,
-            "date": (start_date + timedelta(days=day - 1)).strftime("%Y-%m-%d"),
-            "activities": new_entries,
-            "lunch": [],
-            "stay": []
-        })
-
-    suggestions = suggest_hotels([a for day in itinerary for a in day["activities"]], {"trip": user_input["trip"]})
-    for day_it in itinerary:
+            dist_km = float(state["distance_matrix"][idx_from][idx_to])
+            time_hr = float(state["time_matrix"][idx_from][idx_to])
+            travel_cost = dist_km * people * TAXI_RATE
+            start_str, end_str = assign_time_slot(current_time, time_hr)
+            travel = {
+                "name": f"Travel to {next_entry['name']}",
+                "category": "Travel",
+                "location": f"Travel from {entry['name']} to {next_entry['name']}",
+                "distance": round(dist_km, 2),
+                "distanceUnit": "km",
+                "duration": format_travel_duration(time_hr),
+                "estimatedCost": round(travel_cost, 2),
+                "time_slot": f"{start_str}-{end_str}",
+                "rating": 0.0,
+                "latitude": next_entry["latitude"],
+                "longitude": next_entry["longitude"],
+                "day": day,
+                "date": date
+            }
+            new_entries.append(travel)
+            current_time += timedelta(hours=time_hr)
+
+    return {
+        "day": day,
+        "date": date,
+        "activities": new_entries,
+        "lunch": [],
+        "stay": []
+    }
+
+def attach_hotels(state, day_plans, used_lunch_names=None, used_stay_names=None):
+    """Fill in lunch and stay suggestions of the given day plans."""
+    suggestions = suggest_hotels(
+        [a for day in day_plans for a in day["activities"]],
+        {"trip": state["trip"]},
+        hotels=state["hotels"],
+        used_lunch_names=used_lunch_names,
+        used_stay_names=used_stay_names
+    )
+    for day_it in day_plans:
         key = f"day{day_it['day']}"
         day_it["lunch"] = list(suggestions.get(key, {}).get("lunch", {}).values())
         day_it["stay"] = list(suggestions.get(key, {}).get("stay", {}).values())
 
-    logger.info(f"Generated itinerary in {time.time() - start_time:.2f}s")
-    return convert_to_serializable({"itinerary": itinerary})
+def plan_days(state, daily_budget, activities, max_activities, opt_budget_ms=ROUTE_OPT_BUDGET_MS):
+    """
+    Schedule every day of the trip from scored candidate activities and attach hotels.
+    opt_budget_ms is the route optimizer budget of the whole trip, split evenly over its days.
+    """
+    itinerary = []
+    used_names_global = set()
+    cluster_scheduler = ClusterScheduler(activities)
+    fallback_selector = FallbackSelector(state["fallback_activities"], state["people"])
+
+    with stage("scheduling"):
+        for day in range(1, state["days"] + 1):
+            day_entries = schedule_day(state, day, daily_budget, cluster_scheduler, fallback_selector, used_names_global,
+                                       max_activities=max_activities, opt_budget_ms=opt_budget_ms / state["days"])
+            itinerary.append(build_day_plan(state, day, day_entries))
+
+    with stage("hotel_suggestions"):
+        attach_hotels(state, itinerary)
+    return itinerary
+
+def generate_itinerary(user_input):
+    start_time = time.time()
+    variants = resolve_variants(user_input["trip"])
+    state = prepare_trip(user_input, max(v["budget"] for v in variants) if variants else None)
+    if state is None:
+        return {"itinerary": []} if variants is None else {"itinerary": [], "variants": []}
+
+    if variants is None:
+        itinerary = plan_days(state, state["daily_budget"], state["activities"], state["max_activities"])
+        state["itinerary"] = itinerary
+        token = store_plan(state)
+        logger.info(f"Generated itinerary in {time.time() - start_time:.2f}s")
+        # NumPy values are encoded directly by the app's JSON provider
+        return {"itinerary": itinerary, "token": token}
+
+    # Variants share the candidates, matrices, clusters and hotel index; only scoring and scheduling differ
+    results = []
+    for variant in variants:
+        daily_budget = variant["budget"] / state["days"]
+        activities = [dict(act, score=score_activity(act, daily_budget / state["people"], variant["weights"]))
+                      for act in state["activities"]]
+        itinerary = plan_days(state, daily_budget, activities, variant["maxActivitiesPerDay"], ROUTE_OPT_BUDGET_MS / len(variants))
+        variant_state = dict(state, daily_budget=daily_budget, max_activities=variant["maxActivitiesPerDay"],
+                             activities=activities, itinerary=itinerary)
+        results.append(dict(variant, itinerary=itinerary, token=store_plan(variant_state)))
+
+    logger.info(f"Generated {len(results)} itinerary variants in {time.time() - start_time:.2f}s")
+    return {"itinerary": results[0]["itinerary"], "token": results[0]["token"], "variants": results}
+
+def replan_day(token, edit):
+    """
+    Re-plan a single day of a generated itinerary, reusing its cached candidates,
+    matrices, clusters and hotels. The other days are kept as they are and their
+    activities, lunch and stay spots stay unique across the trip.
+
+    edit: {"day": int, "budget": optional daily budget for that day,
+           "exclude": names not to schedule that day, "include": names to schedule first}
+    Returns the updated itinerary under a new token; the original token stays valid.
+    """
+    start_time = time.time()
+    state = load_plan(token)
+    if not isinstance(edit, dict):
+        raise ValueError("Invalid edit: must be an object")
+    try:
+        day = int(edit["day"])
+        daily_budget = float(edit.get("budget", state["daily_budget"]))
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid edit: {e}")
+    if not np.isfinite(daily_budget) or daily_budget < 0:
+        raise ValueError("Invalid edit: budget must be a non-negative number")
+    if not 1 <= day <= len(state["itinerary"]):
+        raise ValueError(f"Invalid edit: day must be between 1 and {len(state['itinerary'])}")
+    exclude, include = edit.get("exclude", []), edit.get("include", [])
+    for key, names in (("exclude", exclude), ("include", include)):
+        if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+            raise ValueError(f"Invalid edit: {key} must be a list of activity names")
+    exclude = set(exclude)
+    include = list(dict.fromkeys(include))
+    if exclude & set(include):
+        raise ValueError(f"Invalid edit: {sorted(exclude & set(include))} both included and excluded")
+    if len(include) > state["max_activities"]:
+        raise ValueError(f"Invalid edit: at most {state['max_activities']} activities per day")
+
+    other_days = [d for d in state["itinerary"] if d["day"] != day]
+    used_names = {a["name"] for d in other_days for a in d["activities"] if a["category"] != "Travel"}
+    cluster_scheduler = ClusterScheduler(state["activities"])
+    fallback_selector = FallbackSelector(state["fallback_activities"], state["people"])
+    for name in used_names | exclude:
+        cluster_scheduler.mark_used(name)
+        fallback_selector.mark_used(name)
+
+    candidates = {}
+    for a in state["fallback_activities"] + state["activities"]:
+        candidates[a["activity"]["name"]] = a
+    required = []
+    for name in include:
+        if name not in candidates:
+            raise ValueError(f"'{name}' is not a candidate activity for this trip")
+        if name in used_names:
+            raise ValueError(f"'{name}' is already scheduled on another day")
+        required.append(candidates[name])
+
+    day_entries = schedule_day(state, day, daily_budget, cluster_scheduler, fallback_selector, used_names | exclude, required,
+                               max_activities=state["max_activities"], opt_budget_ms=ROUTE_OPT_BUDGET_MS / state["days"])
+    day_plan = build_day_plan(state, day, day_entries)
+    attach_hotels(
+        state, [day_plan],
+        used_lunch_names={h["name"] for d in other_days for h in d["lunch"]},
+        used_stay_names={h["name"] for d in other_days for h in d["stay"]}
+    )
+
+    new_state = dict(state)
+    new_state["itinerary"] = [day_plan if d["day"] == day else d for d in state["itinerary"]]
+    new_token = store_plan(new_state)
+    logger.info(f"Re-planned day {day} in {(time.time() - start_time) * 1000:.1f}ms")
+    return {"itinerary": new_state["itinerary"], "token": new_token}
@@ -4,7 +4,10 @@ from dotenv import load_dotenv
 from pymongo import MongoClient
 from sklearn.metrics.pairwise import cosine_similarity
 import time
+from collections import Counter
 import logging
+import catalog
+import cache_metrics
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -12,11 +15,16 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI")
-if not MONGO_URI:
+if not MONGO_URI and not catalog.CATALOG_DIR:
     raise ValueError("MONGO_URI is missing")
 
 db = None
 
+# Parsed spots and data-quality reports per destination, refreshed after the TTL
+CATALOG_TTL_SECONDS = float(os.getenv("CATALOG_TTL_SECONDS", "600"))
+MAX_REPORTED_SPOTS = 20
+_spot_catalog = {}
+
 trip_keywords = {
     "history": ["historical", "monuments", "museum", "ancient", "heritage", "ruins", "castle", "fort", "palace"],
     "food": ["food", "cuisine", "restaurant", "street food"],
@@ -62,7 +70,7 @@ def safe_string_contains(haystack, needle):
     try:
         haystack_str = str(haystack).lower()
         needle_str = str(needle).lower()
-        logger.debug(f"Checking if '{needle_str}' is in '{haystack_str}'")
+        logger.debug("Checking if '%s' is in '%s'", needle_str, haystack_str)
         return needle_str in haystack_str
     except Exception as e:
         logger.error(f"Error in safe_string_contains: haystack={haystack}, needle={needle}, error={e}")
@@ -72,7 +80,7 @@ def compute_similarity_score(user_prefs, spot_tags, spot_name):
     """Compute similarity score between user preferences and spot tags/name."""
     try:
         spot_name = str(spot_name).strip() if spot_name else ""
-        logger.debug(f"Computing similarity for spot: {spot_name}")
+        logger.debug("Computing similarity for spot: %s", spot_name)
         user_prefs = [str(pref).lower() for pref in user_prefs if str(pref).strip()]
         spot_tags = [str(tag).lower() for tag in spot_tags if str(tag).strip()]
         
@@ -106,198 +114,217 @@ def compute_similarity_score(user_prefs, spot_tags, spot_name):
         logger.error(f"Error computing similarity for spot '{spot_name}': {e}")
         return 0.0
 
-def fetch_low_cost_activities(destination, budget, people, required_activities):
-    """Fetch low-cost activities within budget."""
+def get_db():
+    """Return the TripCraft database, connecting on first use."""
     global db
     if db is None:
+        if not MONGO_URI:
+            raise ValueError("MONGO_URI is missing")
         client = MongoClient(MONGO_URI)
         db = client.get_database("TripCraft")
+    return db
+
+def _report_issue(report, issue, detail):
+    report["counts"][issue] += 1
+    if len(report["examples"][issue]) < MAX_REPORTED_SPOTS:
+        report["examples"][issue].append(detail)
+
+def parse_spots(raw_spots):
+    """
+    Validate raw destination spots and derive their tags and durations.
     
-    start_time = time.time()
-    destination_clean = str(destination).lower().strip()
-    logger.info(f"Fetching low-cost activities for: {destination_clean}")
-    dest_data = db.destination.find_one({"destination": {"$regex": f"^{destination_clean}$", "$options": "i"}})
-    if not dest_data or "spots" not in dest_data:
-        logger.warning(f"No spots found for '{destination_clean}'")
-        return []
-    
-    spots = dest_data["spots"]
-    low_cost_spots = []
-    unique_spot_names = set()
-    unique_coords = set()
+    Returns:
+    - tuple: (spots, report) with the usable spots in catalog order and a data-quality report.
+      Name and coordinate de-duplication is left to the request, as it depends on the budget.
+    """
+    report = {
+        "total_spots": len(raw_spots),
+        "counts": Counter(),
+        "examples": {issue: [] for issue in ("invalid_name", "missing_cost", "invalid_cost", "invalid_coordinates", "duplicate_name", "duplicate_coordinates")}
+    }
+    spots = []
+    seen_names = set()
+    seen_coords = set()
 
-    for spot in spots:
+    for spot in raw_spots:
         spot_name = str(spot.get('name', '')).strip()
-        logger.debug(f"Processing spot: {spot_name}")
-        if not spot_name or spot_name.lower() in unique_spot_names:
-            logger.debug(f"Skipping duplicate or invalid name: {spot_name}")
+        if not spot_name:
+            _report_issue(report, "invalid_name", spot_name)
             continue
         
         cost = spot.get('estimatedCost', None)
         if cost is None:
-            logger.warning(f"No cost data for '{spot_name}', skipping")
+            _report_issue(report, "missing_cost", spot_name)
             continue
         try:
             cost = float(cost)
         except (ValueError, TypeError):
-            logger.warning(f"Invalid cost for '{spot_name}', skipping")
-            continue
-        total_cost = cost * people
-        if total_cost > budget:
-            logger.debug(f"Skipping '{spot_name}' (cost: {total_cost} > budget: {budget})")
+            _report_issue(report, "invalid_cost", spot_name)
             continue
         
         try:
             latitude = float(spot.get("latitude", 0))
             longitude = float(spot.get("longitude", 0))
         except (ValueError, TypeError):
-            logger.warning(f"Invalid coordinates for '{spot_name}', skipping")
+            _report_issue(report, "invalid_coordinates", spot_name)
             continue
         if latitude == 0 or longitude == 0 or not (-90 <= latitude <= 90) or not (-180 <= longitude <= 180):
-            logger.warning(f"Invalid coordinates for '{spot_name}': lat={latitude}, lon={longitude}")
+            _report_issue(report, "invalid_coordinates", f"{spot_name}: lat={latitude}, lon={longitude}")
             continue
         coord = (round(longitude, 6), round(latitude, 6))
-        if coord in unique_coords:
-            logger.warning(f"Duplicate coordinates for '{spot_name}': {coord}")
-            continue
-        unique_coords.add(coord)
+        
+        # Duplicates are reported regardless of budget; requests still decide which copy to keep
+        spot_name_lower = spot_name.lower()
+        if spot_name_lower in seen_names:
+            _report_issue(report, "duplicate_name", spot_name)
+        seen_names.add(spot_name_lower)
+        if coord in seen_coords:
+            _report_issue(report, "duplicate_coordinates", f"{spot_name}: {coord}")
+        seen_coords.add(coord)
         
         category = str(spot.get('category', '')).lower()
         rating = float(spot.get('rating', 4.0)) if isinstance(spot.get('rating', 4.0), (int, float)) else 4.0
         duration = category_durations.get(category.capitalize(), 2)
-        tags = category_to_tags.get(category.capitalize(), [])
-        time_slot = str(spot.get('timeSlot', 'Daytime'))
+        tags = list(category_to_tags.get(category.capitalize(), []))
         
-        spot_name_lower = spot_name.lower()
         for pref, keywords in trip_keywords.items():
             for keyword in keywords:
                 if safe_string_contains(spot_name_lower, keyword):
                     tags.append(pref)
-                    logger.debug(f"Tag '{pref}' added for '{keyword}' in '{spot_name_lower}'")
                     break
         tags = list(set(tags))
         if "shopping" in tags and category in ["spiritual", "history"]:
             tags.remove("shopping")
         
-        unique_spot_names.add(spot_name.lower())
-        
-        activity_data = {
-            "activity": {
-                "name": spot_name,
-                "location": str(spot.get("location", destination)),
-                "estimatedCost": cost,
-                "category": category.capitalize(),
-                "latitude": latitude,
-                "longitude": longitude,
-                "timeSlot": time_slot,
-                "tags": tags
-            },
-            "similarity_score": 0.0,
+        spots.append({
+            "name": spot_name,
+            "name_lower": spot_name_lower,
+            "location": str(spot["location"]) if "location" in spot else None,
+            "estimatedCost": cost,
+            "category": category.capitalize(),
+            "latitude": latitude,
+            "longitude": longitude,
+            "coord": coord,
+            "timeSlot": str(spot.get('timeSlot', 'Daytime')),
+            "tags": tags,
             "rating": rating,
             "duration": duration
-        }
-        low_cost_spots.append((cost, activity_data))
-    
-    low_cost_spots.sort(key=lambda x: x[0])
-    result = [spot[1] for spot in low_cost_spots[:required_activities]]
-    logger.info(f"Returning {len(result)} low-cost activities in {time.time() - start_time:.2f}s")
-    return result
+        })
 
-def find_similar_activities(destination, preferences, budget, people, days):
-    """Find activities matching user preferences within budget."""
-    global db
-    if db is None:
-        client = MongoClient(MONGO_URI)
-        db = client.get_database("TripCraft")
+    report["valid_spots"] = len(spots)
+    report["counts"] = dict(report["counts"])
+    return spots, report
+
+def load_destination_spots(destination):
+    """
+    Return the parsed spots of a destination (None if unknown).
     
-    logger.info(f"Finding similar activities for: {destination}, Preferences: {preferences}, People: {people}")
-    start_time = time.time()
+    Spots come from the binary catalog when it has the destination, otherwise from Mongo;
+    they are reloaded after the TTL or when a new catalog version is activated.
+    """
     destination_clean = str(destination).lower().strip()
-    dest_data = db.destination.find_one({"destination": {"$regex": f"^{destination_clean}$", "$options": "i"}})
-    if not dest_data or "spots" not in dest_data:
-        logger.warning(f"No spots found for '{destination_clean}'")
-        return []
+    version = catalog.current_version()
+    cached = _spot_catalog.get(destination_clean)
+    if cached and cached["version"] == version and cache_metrics.is_fresh(time.time() - cached["loaded_at"], CATALOG_TTL_SECONDS):
+        cache_metrics.record("spots", hit=True)
+        return cached["spots"]
+    cache_metrics.record("spots", hit=False)
     
-    preferences = [p for p in preferences if p in trip_keywords] if preferences else []
-    logger.debug(f"Validated preferences: {preferences}")
+    snapshot = catalog.get_spots(destination_clean)
+    if snapshot is not None:
+        spots, report, version = snapshot["spots"], snapshot["report"], snapshot["version"]
+        for spot in spots:
+            spot["name_lower"] = spot["name"].lower()
+            spot["coord"] = (round(spot["longitude"], 6), round(spot["latitude"], 6))
+    else:
+        dest_data = get_db().destination.find_one({"destination": {"$regex": f"^{destination_clean}$", "$options": "i"}})
+        if not dest_data or "spots" not in dest_data:
+            logger.warning(f"No spots found for '{destination_clean}'")
+            return None
+        spots, report = parse_spots(dest_data["spots"])
+        report["destination"] = destination_clean
+        report["generated_at"] = time.time()
+        version = None
+        if report["counts"]:
+            logger.warning(f"Data-quality issues for '{destination_clean}': {report['counts']} ({len(spots)}/{report['total_spots']} spots usable)")
+    
+    _spot_catalog[destination_clean] = {"loaded_at": time.time(), "version": version, "spots": spots, "report": report}
+    return spots
+
+def get_data_quality_report(destination=None):
+    """Data-quality reports of loaded destinations, or of a single destination (None if not loaded)."""
+    if destination is None:
+        return {name: entry["report"] for name, entry in _spot_catalog.items()}
+    entry = _spot_catalog.get(str(destination).lower().strip())
+    return entry["report"] if entry else None
 
-    spots = dest_data["spots"]
-    all_spots = []
+def select_spots(spots, destination, budget, people, preferences=None):
+    """Budget-filter and de-duplicate parsed spots in catalog order, building per-request activity data."""
+    selected = []
     unique_spot_names = set()
     unique_coords = set()
+    skipped = Counter()
 
     for spot in spots:
-        spot_name = str(spot.get('name', '')).strip()
-        logger.debug(f"Processing spot: {spot_name}")
-        if not spot_name or spot_name.lower() in unique_spot_names:
-            logger.debug(f"Skipping duplicate or invalid name: {spot_name}")
-            continue
-        
-        cost = spot.get('estimatedCost', None)
-        if cost is None:
-            logger.warning(f"No cost data for '{spot_name}', skipping")
-            continue
-        try:
-            cost = float(cost)
-        except (ValueError, TypeError):
-            logger.warning(f"Invalid cost for '{spot_name}', skipping")
-            continue
-        total_cost = cost * people
-        if total_cost > budget:
-            logger.debug(f"Skipping '{spot_name}' (cost: {total_cost} > budget: {budget})")
-            continue
-        
-        try:
-            latitude = float(spot.get("latitude", 0))
-            longitude = float(spot.get("longitude", 0))
-        except (ValueError, TypeError):
-            logger.warning(f"Invalid coordinates for '{spot_name}', skipping")
+        if spot["name_lower"] in unique_spot_names:
+            skipped["duplicate_name"] += 1
             continue
-        if latitude == 0 or longitude == 0 or not (-90 <= latitude <= 90) or not (-180 <= longitude <= 180):
-            logger.warning(f"Invalid coordinates for '{spot_name}': lat={latitude}, lon={longitude}")
+        if spot["estimatedCost"] * people > budget:
+            skipped["over_budget"] += 1
             continue
-        coord = (round(longitude, 6), round(latitude, 6))
-        if coord in unique_coords:
-            logger.warning(f"Duplicate coordinates for '{spot_name}': {coord}")
+        if spot["coord"] in unique_coords:
+            skipped["duplicate_coordinates"] += 1
             continue
-        unique_coords.add(coord)
+        unique_coords.add(spot["coord"])
+        unique_spot_names.add(spot["name_lower"])
         
-        category = str(spot.get('category', '')).lower()
-        rating = float(spot.get('rating', 4.0)) if isinstance(spot.get('rating', 4.0), (int, float)) else 4.0
-        duration = category_durations.get(category.capitalize(), 2)
-        tags = category_to_tags.get(category.capitalize(), [])
-        time_slot = str(spot.get('timeSlot', 'Daytime'))
-        
-        spot_name_lower = spot_name.lower()
-        for pref, keywords in trip_keywords.items():
-            for keyword in keywords:
-                if safe_string_contains(spot_name_lower, keyword):
-                    tags.append(pref)
-                    logger.debug(f"Tag '{pref}' added for '{keyword}' in '{spot_name_lower}'")
-                    break
-        tags = list(set(tags))
-        if "shopping" in tags and category in ["spiritual", "history"]:
-            tags.remove("shopping")
-        
-        unique_spot_names.add(spot_name.lower())
-        
-        similarity_score = compute_similarity_score(preferences, tags, spot_name) if preferences else 0.0
-        activity_data = {
+        similarity_score = compute_similarity_score(preferences, spot["tags"], spot["name"]) if preferences else 0.0
+        selected.append({
             "activity": {
-                "name": spot_name,
-                "location": str(spot.get("location", destination)),
-                "estimatedCost": cost,
-                "category": category.capitalize(),
-                "latitude": latitude,
-                "longitude": longitude,
-                "timeSlot": time_slot,
-                "tags": tags
+                "name": spot["name"],
+                "location": spot["location"] if spot["location"] is not None else str(destination),
+                "estimatedCost": spot["estimatedCost"],
+                "category": spot["category"],
+                "latitude": spot["latitude"],
+                "longitude": spot["longitude"],
+                "timeSlot": spot["timeSlot"],
+                "tags": list(spot["tags"])
             },
             "similarity_score": similarity_score,
-            "rating": rating,
-            "duration": duration
-        }
-        all_spots.append(activity_data)
+            "rating": spot["rating"],
+            "duration": spot["duration"]
+        })
+
+    if skipped:
+        logger.info(f"Skipped spots: {dict(skipped)}")
+    return selected
+
+def fetch_low_cost_activities(destination, budget, people, required_activities):
+    """Fetch low-cost activities within budget."""
+    start_time = time.time()
+    logger.info(f"Fetching low-cost activities for: {str(destination).lower().strip()}")
+    spots = load_destination_spots(destination)
+    if spots is None:
+        return []
+    
+    low_cost_spots = select_spots(spots, destination, budget, people)
+    low_cost_spots.sort(key=lambda x: x["activity"]["estimatedCost"])
+    result = low_cost_spots[:required_activities]
+    logger.info(f"Returning {len(result)} low-cost activities in {time.time() - start_time:.2f}s")
+    return result
+
+def find_similar_activities(destination, preferences, budget, people, days):
+    """Find activities matching user preferences within budget."""
+    logger.info(f"Finding similar activities for: {destination}, Preferences: {preferences}, People: {people}")
+    start_time = time.time()
+    spots = load_destination_spots(destination)
+    if spots is None:
+        return []
+    
+    preferences = [p for p in preferences if p in trip_keywords] if preferences else []
+    logger.debug("Validated preferences: %s", preferences)
+
+    all_spots = select_spots(spots, destination, budget, people, preferences)
     
     required_activities = min(50, max(20, 7 * days))
     logger.info(f"Need {required_activities} activities, found {len(all_spots)}")
@@ -1,22 +1,128 @@
 #The entry point of the application containing the flask server which is responsibe for serving the application
 
+import os
+import time
+import threading
+from collections import OrderedDict
 from flask import Flask, request, jsonify
-from Itinerary_Generator import generate_itinerary
+from Itinerary_Generator import generate_itinerary, replan_day, has_plan, resolve_variants
+from Similarity_Algorithm import get_data_quality_report
+from json_provider import NumpyJSONProvider, dumps_bytes
+import catalog
+import profiling
+import cache_metrics
+import warmer
 
 app = Flask(__name__)  # use __name__
+app.json = NumpyJSONProvider(app)
+
+# Encoded responses of recent identical requests (per catalog version), served as pre-encoded bytes
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "128"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+response_cache = OrderedDict()
+response_cache_lock = threading.Lock()
+
+# Map the binary destination catalog (if configured) before serving requests
+catalog.current_version()
+# Keep the caches of popular destinations warm in the background
+warmer.start()
 
 @app.route('/generate_itinerary', methods=['POST'])
 def generate():
     data = request.get_json()
+    warmer.record_request(data)
+    with warmer.foreground():
+        return _generate(data)
+
+def _generate(data):
+    # Invalid variant settings are a client error
+    trip = data.get("trip") if isinstance(data, dict) else None
+    if isinstance(trip, dict):
+        try:
+            resolve_variants(trip)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
     try:
+        destination = ((data or {}).get("trip") or {}).get("destination")
+        if profiling.should_profile(destination, request.headers.get("X-Profile")):
+            itinerary, profile_id = profiling.run_profiled(generate_itinerary, data, destination=destination)
+            response = jsonify(itinerary)
+            if profile_id:
+                response.headers["X-Profile-Id"] = profile_id
+            return response
+        cache_key = dumps_bytes([catalog.current_version(), data])
+        with response_cache_lock:
+            cached = response_cache.get(cache_key)
+            # A cached response is only served while its re-planning tokens are still valid
+            if cached and time.time() - cached[0] < RESPONSE_CACHE_TTL and all(has_plan(token) for token in cached[2]):
+                response_cache.move_to_end(cache_key)
+                return app.response_class(cached[1], mimetype="application/json")
         itinerary = generate_itinerary(data)
-        return jsonify(itinerary)
+        body = dumps_bytes(itinerary)
+        if RESPONSE_CACHE_SIZE > 0:
+            tokens = [v["token"] for v in itinerary.get("variants", [])] or [t for t in [itinerary.get("token")] if t]
+            with response_cache_lock:
+                response_cache[cache_key] = (time.time(), body, tokens)
+                while len(response_cache) > RESPONSE_CACHE_SIZE:
+                    response_cache.popitem(last=False)
+        return app.response_class(body, mimetype="application/json")
     except Exception as e:
         import traceback
         print(f"Error in itinerary: {e}")
         print(traceback.format_exc())
         return jsonify({"error": str(e)}), 500
 
+@app.route('/replan_itinerary', methods=['POST'])
+def replan():
+    data = request.get_json()
+    if not isinstance(data, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+    try:
+        return jsonify(replan_day(data.get("token"), data.get("edit") or {}))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        import traceback
+        print(f"Error in re-planning: {e}")
+        print(traceback.format_exc())
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/admin/data_quality', methods=['GET'])
+def data_quality():
+    destination = request.args.get('destination')
+    report = get_data_quality_report(destination)
+    if report is None:
+        return jsonify({"error": f"No data-quality report for '{destination}' (destination not loaded yet)"}), 404
+    return jsonify(report)
+
+@app.route('/admin/metrics', methods=['GET'])
+def metrics():
+    return jsonify({"caches": cache_metrics.snapshot(), "warmer": warmer.status()})
+
+@app.route('/admin/profiling', methods=['GET', 'POST'])
+def profiling_toggle():
+    if request.method == 'POST':
+        data = request.get_json() or {}
+        destination = data.get("destination")
+        if data.get("enabled", True):
+            if not destination:
+                return jsonify({"error": "destination is required"}), 400
+            profiling.arm(destination)
+        else:
+            profiling.disarm(destination)
+    return jsonify({"armed": profiling.armed_destinations(), "min_interval": profiling.PROFILE_MIN_INTERVAL})
+
+@app.route('/admin/profiles', methods=['GET'])
+def profiles():
+    return jsonify(profiling.list_profiles())
+
+@app.route('/admin/profiles/<profile_id>', methods=['GET'])
+def profile(profile_id):
+    record = profiling.get_profile(profile_id)
+    if record is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return jsonify(record)
+
 if __name__ == '__main__':  # use __name__ and '__main__'
     print("Starting Flask server...")
     app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
@@ -0,0 +1,48 @@
+#Hit/miss counters of the in-process caches and the refresh-ahead freshness rule shared by them
+
+import os
+import threading
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+
+# Fraction of a TTL after which the background warmer refreshes an entry
+REFRESH_AHEAD_RATIO = float(os.getenv("REFRESH_AHEAD_RATIO", "0.8"))
+
+_warming = contextvars.ContextVar("warming", default=False)
+_lock = threading.Lock()
+counters = Counter()
+
+@contextmanager
+def warming():
+    """Mark cache lookups in this context as done by the warmer."""
+    token = _warming.set(True)
+    try:
+        yield
+    finally:
+        _warming.reset(token)
+
+def is_fresh(age, ttl):
+    """Whether a cache entry of this age can be served; the warmer treats entries close to expiry as stale."""
+    if _warming.get():
+        return age < ttl * REFRESH_AHEAD_RATIO
+    return age < ttl
+
+def record(cache, hit):
+    """Count a lookup; warmer lookups are counted separately from foreground ones."""
+    prefix = "warm" if _warming.get() else "foreground"
+    with _lock:
+        counters[f"{cache}.{prefix}.{'hit' if hit else 'miss'}"] += 1
+
+def snapshot():
+    """Counters per cache with the foreground (cold) miss rate."""
+    with _lock:
+        items = dict(counters)
+    caches = {}
+    for key, value in items.items():
+        cache, prefix, kind = key.rsplit(".", 2)
+        caches.setdefault(cache, {})[f"{prefix}_{kind}es" if kind == "miss" else f"{prefix}_{kind}s"] = value
+    for stats in caches.values():
+        lookups = stats.get("foreground_hits", 0) + stats.get("foreground_misses", 0)
+        stats["cold_miss_rate"] = round(stats.get("foreground_misses", 0) / lookups, 4) if lookups else None
+    return caches
@@ -0,0 +1,94 @@
+#Read-only access to the binary destination catalog written by export_catalog.py
+
+import os
+import json
+import time
+import threading
+import numpy as np
+from dotenv import load_dotenv
+import logging
+
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Catalog root (unset: serve from Mongo only). The CURRENT file names the active version directory.
+CATALOG_DIR = os.getenv("CATALOG_DIR")
+CATALOG_CHECK_SECONDS = float(os.getenv("CATALOG_CHECK_SECONDS", "30"))
+
+SPOT_FIELDS = ["name", "location", "has_location", "estimatedCost", "category", "latitude", "longitude", "timeSlot", "tags", "rating", "duration"]
+HOTEL_FIELDS = ["name", "location", "rating", "pricePerNight", "longitude", "latitude", "stayType"]
+
+_snapshot = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+def destination_key(destination):
+    """Catalog lookup key of a destination name."""
+    return str(destination).lower().strip()
+
+def _load_version(version):
+    """Memory-map every array of a catalog version."""
+    root = os.path.join(CATALOG_DIR, version)
+    with open(os.path.join(root, "manifest.json")) as f:
+        manifest = json.load(f)
+    destinations = {}
+    for key, entry in manifest["destinations"].items():
+        destinations[key] = {
+            "spots": np.load(os.path.join(root, entry["spots_file"]), mmap_mode="r"),
+            "hotels": np.load(os.path.join(root, entry["hotels_file"]), mmap_mode="r"),
+            "report": entry["report"]
+        }
+    logger.info(f"Loaded catalog version {version} with {len(destinations)} destinations")
+    return {"version": version, "destinations": destinations}
+
+def _current():
+    """Active snapshot, switching to a newer version when CURRENT changes (checked at most every CATALOG_CHECK_SECONDS)."""
+    global _snapshot, _checked_at
+    if not CATALOG_DIR:
+        return None
+    if time.time() - _checked_at < CATALOG_CHECK_SECONDS:
+        return _snapshot
+    with _lock:
+        if time.time() - _checked_at < CATALOG_CHECK_SECONDS:
+            return _snapshot
+        _checked_at = time.time()
+        try:
+            with open(os.path.join(CATALOG_DIR, "CURRENT")) as f:
+                version = f.read().strip()
+            if _snapshot is None or _snapshot["version"] != version:
+                # Readers keep using the old snapshot until the new one is fully mapped
+                _snapshot = _load_version(version)
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Failed to load catalog from {CATALOG_DIR}: {e}")
+    return _snapshot
+
+def current_version():
+    """Version of the active catalog, or None when serving from Mongo."""
+    snapshot = _current()
+    return snapshot["version"] if snapshot else None
+
+def get_spots(destination):
+    """Validated spots of a destination as dicts, with the version and data-quality report (None if not in the catalog)."""
+    snapshot = _current()
+    entry = snapshot["destinations"].get(destination_key(destination)) if snapshot else None
+    if entry is None:
+        return None
+    spots = []
+    for row in entry["spots"].tolist():
+        spot = dict(zip(SPOT_FIELDS, row))
+        spot["location"] = spot["location"] if spot.pop("has_location") else None
+        spot["tags"] = spot["tags"].split("|") if spot["tags"] else []
+        spot["duration"] = int(spot["duration"])
+        spots.append(spot)
+    return {"version": snapshot["version"], "spots": spots, "report": entry["report"]}
+
+def get_hotels(destination):
+    """Hotels and lunch spots (valid coordinates only) of a destination as dicts (None if not in the catalog)."""
+    snapshot = _current()
+    entry = snapshot["destinations"].get(destination_key(destination)) if snapshot else None
+    if entry is None:
+        return None
+    return [dict(zip(HOTEL_FIELDS, row)) for row in entry["hotels"].tolist()]
@@ -0,0 +1,127 @@
+#Export job snapshotting the TripCraft.destination collection into a versioned binary catalog
+#Usage: python export_catalog.py [--out CATALOG_DIR] [--keep N]
+
+import os
+import re
+import json
+import shutil
+import time
+import argparse
+import tempfile
+from datetime import datetime
+import numpy as np
+from catalog import CATALOG_DIR, SPOT_FIELDS, HOTEL_FIELDS, destination_key
+from Similarity_Algorithm import get_db, parse_spots
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def _text_width(values):
+    return max([len(v) for v in values] + [1])
+
+def build_spot_array(spots):
+    """Structured array of parsed spots (fixed-width text, no Python objects, so it can be memory-mapped)."""
+    rows = [(
+        spot["name"],
+        spot["location"] or "",
+        spot["location"] is not None,
+        spot["estimatedCost"],
+        spot["category"],
+        spot["latitude"],
+        spot["longitude"],
+        spot["timeSlot"],
+        "|".join(spot["tags"]),
+        spot["rating"],
+        spot["duration"]
+    ) for spot in spots]
+    dtype = [
+        ("name", f"U{_text_width([r[0] for r in rows])}"),
+        ("location", f"U{_text_width([r[1] for r in rows])}"),
+        ("has_location", "?"),
+        ("estimatedCost", "f8"),
+        ("category", f"U{_text_width([r[4] for r in rows])}"),
+        ("latitude", "f8"),
+        ("longitude", "f8"),
+        ("timeSlot", f"U{_text_width([r[7] for r in rows])}"),
+        ("tags", f"U{_text_width([r[8] for r in rows])}"),
+        ("rating", "f8"),
+        ("duration", "i4")
+    ]
+    assert [name for name, _ in dtype] == SPOT_FIELDS
+    return np.array(rows, dtype=dtype)
+
+def build_hotel_array(hotels):
+    """Structured array of hotels and lunch spots with valid coordinates and numeric fields."""
+    rows = []
+    for hotel in hotels:
+        try:
+            lat = float(hotel.get("latitude", 0))
+            lon = float(hotel.get("longitude", 0))
+            rating = float(hotel.get("rating", 0))
+            price = float(hotel.get("pricePerNight", 0))
+        except (ValueError, TypeError):
+            logger.warning(f"Skipping hotel '{hotel.get('name', 'Unknown')}' due to invalid numeric fields")
+            continue
+        if lat == 0 or lon == 0:
+            continue
+        rows.append((str(hotel.get("name", "")), str(hotel.get("location", "")), rating, price, lon, lat, str(hotel.get("stayType", ""))))
+    dtype = [
+        ("name", f"U{_text_width([r[0] for r in rows])}"),
+        ("location", f"U{_text_width([r[1] for r in rows])}"),
+        ("rating", "f8"),
+        ("pricePerNight", "f8"),
+        ("longitude", "f8"),
+        ("latitude", "f8"),
+        ("stayType", f"U{_text_width([r[6] for r in rows])}")
+    ]
+    assert [name for name, _ in dtype] == HOTEL_FIELDS
+    return np.array(rows, dtype=dtype)
+
+def export_catalog(out_dir, keep=3):
+    """Write a new catalog version under out_dir and atomically make it current."""
+    version = datetime.utcnow().strftime("v%Y%m%d%H%M%S")
+    os.makedirs(out_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=f".{version}-", dir=out_dir)
+    manifest = {"version": version, "created_at": datetime.utcnow().isoformat() + "Z", "destinations": {}}
+
+    for i, doc in enumerate(get_db().destination.find({}, {"destination": 1, "spots": 1, "hotels": 1})):
+        key = destination_key(doc.get("destination", ""))
+        if not key or key in manifest["destinations"]:
+            logger.warning(f"Skipping missing or duplicate destination '{key}'")
+            continue
+        spots, report = parse_spots(doc.get("spots", []))
+        report["destination"] = key
+        report["generated_at"] = time.time()
+        stem = f"{i:04d}_{re.sub(r'[^a-z0-9]+', '_', key)}"
+        np.save(os.path.join(tmp_dir, f"{stem}.spots.npy"), build_spot_array(spots))
+        np.save(os.path.join(tmp_dir, f"{stem}.hotels.npy"), build_hotel_array(doc.get("hotels", [])))
+        manifest["destinations"][key] = {
+            "spots_file": f"{stem}.spots.npy",
+            "hotels_file": f"{stem}.hotels.npy",
+            "report": report
+        }
+
+    with open(os.path.join(tmp_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f)
+    os.rename(tmp_dir, os.path.join(out_dir, version))
+
+    # Switch readers to the new version in one atomic rename
+    current_tmp = os.path.join(out_dir, "CURRENT.tmp")
+    with open(current_tmp, "w") as f:
+        f.write(version)
+    os.replace(current_tmp, os.path.join(out_dir, "CURRENT"))
+    logger.info(f"Exported catalog version {version} with {len(manifest['destinations'])} destinations to {out_dir}")
+
+    # Keep a few old versions for processes that have not switched yet
+    versions = sorted(d for d in os.listdir(out_dir) if d.startswith("v") and os.path.isdir(os.path.join(out_dir, d)))
+    for old in versions[:-keep]:
+        shutil.rmtree(os.path.join(out_dir, old), ignore_errors=True)
+    return version
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export the destination collection into a binary catalog")
+    parser.add_argument("--out", default=CATALOG_DIR or "catalog", help="catalog root directory (default: CATALOG_DIR)")
+    parser.add_argument("--keep", type=int, default=3, help="number of versions to keep")
+    args = parser.parse_args()
+    export_catalog(args.out, args.keep)
@@ -1,14 +1,8 @@
 from math import radians, sin, cos, sqrt, asin
 from datetime import datetime
-from pymongo import MongoClient
-from dotenv import load_dotenv
-import os
-
-# Load environment variables
-load_dotenv()
-MONGO_URI = os.getenv("MONGO_URI")
-if not MONGO_URI:
-    raise ValueError("MONGO_URI is missing")
+import heapq
+import catalog
+from Similarity_Algorithm import get_db
 
 def haversine(lon1, lat1, lon2, lat2):
     """Calculate the great circle distance between two points on Earth."""
@@ -29,40 +23,71 @@ def is_lunch_time_slot(time_slot):
     except ValueError:
         return False
 
-def suggest_hotels(activities, user_input):
-    """Suggest hotels and lunch spots based on activity locations."""
-    client = MongoClient(MONGO_URI)
-    db = client["TripCraft"]
-    collection = db["destination"]
-    try:
-        start_date = datetime.strptime(user_input["trip"]["startDate"], "%Y-%m-%d")
-        end_date = datetime.strptime(user_input["trip"]["endDate"], "%Y-%m-%d")
-        days = (end_date - start_date).days + 1
-        people = int(user_input["trip"]["people"])
-        budget = float(user_input["trip"]["budget"])
-        destination = user_input["trip"]["destination"]
-        preferences = user_input["trip"].get("preferences", [])
-    except (KeyError, ValueError) as e:
-        raise ValueError(f"Invalid input: {str(e)}")
+def load_hotels(destination):
+    """Hotels and lunch spots of a destination with valid coordinates."""
+    # The binary catalog only holds hotels with valid coordinates
+    hotels = catalog.get_hotels(destination)
+    if hotels is not None:
+        return hotels
 
-    destination_doc = collection.find_one({"destination": destination})
+    destination_doc = get_db().destination.find_one({"destination": destination})
     if not destination_doc:
         raise ValueError("Destination not found in database")
 
-    hotels = destination_doc.get("hotels", [])
     # Validate hotel coordinates
     valid_hotels = []
-    for hotel in hotels:
+    for hotel in destination_doc.get("hotels", []):
         lat = float(hotel.get("latitude", 0))
         lon = float(hotel.get("longitude", 0))
         if lat == 0 or lon == 0:
             print(f"Skipping hotel '{hotel.get('name', 'Unknown')}' due to invalid coordinates")
             continue
         valid_hotels.append(hotel)
-    hotels = valid_hotels
+    return valid_hotels
+
+class HotelIndex:
+    """
+    Stay and lunch spots of a destination with memoized nearest-spot lookups, so that
+    itineraries planned from the same pipeline run (variants, re-planned days) share them.
+    """
+
+    def __init__(self, hotels):
+        self.spots = {"Stay": [], "Lunch": []}
+        for h in hotels:
+            if h.get("stayType") in self.spots:
+                self.spots[h["stayType"]].append(h)
+        self._nearest = {}
+
+    def nearest(self, stay_type, lon, lat, k):
+        """The k spots of a stay type closest to a point, in the order sorted() by distance gives."""
+        key = (stay_type, lon, lat, k)
+        result = self._nearest.get(key)
+        if result is None:
+            result = heapq.nsmallest(k, self.spots[stay_type], key=lambda h: haversine(float(h["longitude"]), float(h["latitude"]), lon, lat))
+            self._nearest[key] = result
+        return result
+
+def suggest_hotels(activities, user_input, hotels=None, used_lunch_names=None, used_stay_names=None):
+    """
+    Suggest hotels and lunch spots based on activity locations.
+
+    hotels may be passed in when already loaded (as a list or a HotelIndex); used_lunch_names and used_stay_names
+    hold spots suggested on days outside activities, which are not suggested again.
+    """
+    try:
+        start_date = datetime.strptime(user_input["trip"]["startDate"], "%Y-%m-%d")
+        end_date = datetime.strptime(user_input["trip"]["endDate"], "%Y-%m-%d")
+        days = (end_date - start_date).days + 1
+        people = int(user_input["trip"]["people"])
+        budget = float(user_input["trip"]["budget"])
+        destination = user_input["trip"]["destination"]
+        preferences = user_input["trip"].get("preferences", [])
+    except (KeyError, ValueError) as e:
+        raise ValueError(f"Invalid input: {str(e)}")
 
-    stay_hotels = [h for h in hotels if h.get("stayType") == "Stay"]
-    lunch_restaurants = [h for h in hotels if h.get("stayType") == "Lunch"]
+    if hotels is None:
+        hotels = load_hotels(destination)
+    index = hotels if isinstance(hotels, HotelIndex) else HotelIndex(hotels)
 
     day_map = {}
     for activity in activities:
@@ -70,8 +95,8 @@ def suggest_hotels(activities, user_input):
         day_map.setdefault(day, []).append(activity)
 
     suggestions = {}
-    used_lunch_names = set()  # Track used lunch spots
-    used_stay_names = set()   # Track used stay spots
+    used_lunch_names = set(used_lunch_names or ())  # Track used lunch spots
+    used_stay_names = set(used_stay_names or ())    # Track used stay spots
 
     for day, activities in day_map.items():
         day_key = f"day{day}"
@@ -87,15 +112,9 @@ def suggest_hotels(activities, user_input):
 
         # Stay suggestions (closest to last activity)
         last_activity = day_activities[-1]
-        if stay_hotels:
-            stay_sorted = sorted(
-                stay_hotels,
-                key=lambda h: haversine(
-                    float(h["longitude"]), float(h["latitude"]),
-                    float(last_activity["longitude"]), float(last_activity["latitude"])
-                )
-            )
-            for i, spot in enumerate(stay_sorted[:4], 1):
+        if index.spots["Stay"]:
+            stay_sorted = index.nearest("Stay", float(last_activity["longitude"]), float(last_activity["latitude"]), 4)
+            for i, spot in enumerate(stay_sorted, 1):
                 if spot["name"] not in used_stay_names:  # Only add unused stays
                     suggestions[day_key]["stay"][f"spot{i}"] = {
                         "name": spot["name"],
@@ -111,16 +130,10 @@ def suggest_hotels(activities, user_input):
 
         # Lunch suggestions (closest to lunch-time activity)
         lunch_activities = [a for a in day_activities if is_lunch_time_slot(a["time_slot"])]
-        if lunch_activities and lunch_restaurants:
+        if lunch_activities and index.spots["Lunch"]:
             lunch_activity = lunch_activities[0]
-            lunch_sorted = sorted(
-                lunch_restaurants,
-                key=lambda r: haversine(
-                    float(r["longitude"]), float(r["latitude"]),
-                    float(lunch_activity["longitude"]), float(lunch_activity["latitude"])
-                )
-            )
-            for i, spot in enumerate(lunch_sorted[:3], 1):
+            lunch_sorted = index.nearest("Lunch", float(lunch_activity["longitude"]), float(lunch_activity["latitude"]), 3)
+            for i, spot in enumerate(lunch_sorted, 1):
                 if spot["name"] not in used_lunch_names:  # Only add unused lunch spots
                     suggestions[day_key]["lunch"][f"spot{i}"] = {
                         "name": spot["name"],
@@ -0,0 +1,46 @@
+#Flask JSON provider encoding NumPy scalars and arrays natively, backed by orjson when it is installed
+
+import json
+import numpy as np
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib encoder
+    orjson = None
+
+def _default(obj):
+    """Convert objects the encoder does not handle itself (NumPy types without orjson, dates, ...)."""
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, np.floating):
+        return float(obj)
+    if isinstance(obj, np.bool_):
+        return bool(obj)
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    return DefaultJSONProvider.default(obj)
+
+def dumps_bytes(obj):
+    """Encode obj to UTF-8 JSON bytes with sorted keys, as the default Flask provider does."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_SORT_KEYS)
+    return json.dumps(obj, default=_default, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+class NumpyJSONProvider(DefaultJSONProvider):
+    """Encodes NumPy values without a recursive conversion pass over the response."""
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs:
+            return dumps_bytes(obj).decode("utf-8")
+        kwargs.setdefault("default", _default)
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj), mimetype=self.mimetype)
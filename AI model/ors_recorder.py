@@ -0,0 +1,66 @@
+#Record/replay store for raw ORS matrix responses, used to run the pipeline deterministically offline
+
+import os
+import hashlib
+import tempfile
+import time
+import random
+import numpy as np
+from dotenv import load_dotenv
+import logging
+
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# off: always call ORS, record: call ORS and store responses, replay: serve stored responses only
+MODE = os.getenv("ORS_CACHE_MODE", "off").lower()
+CACHE_DIR = os.getenv("ORS_CACHE_DIR", "ors_cache")
+REPLAY_LATENCY_MS = float(os.getenv("ORS_REPLAY_LATENCY_MS", "0"))
+REPLAY_JITTER_MS = float(os.getenv("ORS_REPLAY_JITTER_MS", "0"))
+
+if MODE not in ("off", "record", "replay"):
+    raise ValueError(f"Invalid ORS_CACHE_MODE '{MODE}', expected 'off', 'record' or 'replay'")
+
+def cache_path(coords, profile):
+    """Path of the recorded response for a coordinate list and profile."""
+    key = profile + "|" + ";".join(f"{lon:.6f},{lat:.6f}" for lon, lat in coords)
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return os.path.join(CACHE_DIR, f"{profile}-{digest}.npz")
+
+def record(coords, profile, distances, durations):
+    """Store a matrix response (km, seconds) as a compressed .npz file."""
+    path = cache_path(coords, profile)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez_compressed(
+                f,
+                coords=np.asarray(coords, dtype=np.float64),
+                distances=np.asarray(distances, dtype=np.float32),
+                durations=np.asarray(durations, dtype=np.float32)
+            )
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    logger.info(f"Recorded ORS matrix for {len(coords)} locations to {path}")
+
+def replay(coords, profile):
+    """Return a recorded (distances, durations) pair, optionally after a simulated delay."""
+    path = cache_path(coords, profile)
+    if not os.path.exists(path):
+        raise ValueError(f"No recorded ORS matrix for {len(coords)} locations ({profile}) at {path}")
+    with np.load(path) as data:
+        if not np.allclose(data["coords"], np.asarray(coords, dtype=np.float64)):
+            raise ValueError(f"Recorded ORS matrix at {path} does not match the requested coordinates")
+        distances = data["distances"]
+        durations = data["durations"]
+    latency = REPLAY_LATENCY_MS + random.uniform(0, REPLAY_JITTER_MS)
+    if latency > 0:
+        time.sleep(latency / 1000)
+    return distances, durations
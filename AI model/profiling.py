@@ -0,0 +1,145 @@
+#Opt-in, rate-limited profiling of single itinerary requests with per-stage timings
+
+import os
+import io
+import time
+import uuid
+import cProfile
+import pstats
+import threading
+import contextvars
+from collections import OrderedDict
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PROFILE_MIN_INTERVAL = float(os.getenv("PROFILE_MIN_INTERVAL", "60"))  # seconds between two profiles
+PROFILE_MAX_STORED = int(os.getenv("PROFILE_MAX_STORED", "20"))
+PROFILE_TOP_FUNCTIONS = int(os.getenv("PROFILE_TOP_FUNCTIONS", "40"))
+
+# Record of the request being profiled in this context, None otherwise
+_current = contextvars.ContextVar("profile_record", default=None)
+_profile_lock = threading.Lock()  # only one cProfile can run at a time
+_state_lock = threading.Lock()
+_last_profiled = 0.0
+_armed_destinations = set()
+profiles = OrderedDict()
+
+class _Stage:
+    __slots__ = ("name", "record", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.record = _current.get()
+        if self.record is not None:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.record is not None:
+            stages = self.record["stages"]
+            stages[self.name] = stages.get(self.name, 0.0) + (time.perf_counter() - self.start) * 1000
+        return False
+
+def stage(name):
+    """Time a pipeline stage (in ms) when the current request is profiled; a no-op otherwise."""
+    return _Stage(name)
+
+def record_sizes(**sizes):
+    """Attach input sizes (spot count, matrix size, days, ...) to the current profile, if any."""
+    record = _current.get()
+    if record is not None:
+        record["sizes"].update(sizes)
+
+def arm(destination):
+    """Profile the next request for a destination (admin toggle)."""
+    with _state_lock:
+        _armed_destinations.add(str(destination).lower().strip())
+
+def disarm(destination=None):
+    with _state_lock:
+        if destination is None:
+            _armed_destinations.clear()
+        else:
+            _armed_destinations.discard(str(destination).lower().strip())
+
+def armed_destinations():
+    with _state_lock:
+        return sorted(_armed_destinations)
+
+def should_profile(destination, header_value=None):
+    """Whether to profile this request: requested by header or armed destination, and not rate limited."""
+    key = str(destination).lower().strip()
+    requested = header_value is not None and header_value.lower() in ("1", "true", "yes")
+    with _state_lock:
+        if not requested and key not in _armed_destinations:
+            return False
+        if time.time() - _last_profiled < PROFILE_MIN_INTERVAL:
+            logger.info(f"Profiling of '{key}' skipped (rate limited)")
+            return False
+    return True
+
+def _claim(destination):
+    """Take the profiler and the rate-limit slot together; disarm the destination once claimed."""
+    global _last_profiled
+    if not _profile_lock.acquire(blocking=False):
+        return False
+    with _state_lock:
+        if time.time() - _last_profiled < PROFILE_MIN_INTERVAL:
+            _profile_lock.release()
+            return False
+        _last_profiled = time.time()
+        _armed_destinations.discard(str(destination).lower().strip())
+    return True
+
+def run_profiled(func, *args, destination=None):
+    """
+    Run func(*args) under cProfile and store the profile with its stage timings and sizes.
+
+    Returns (result, profile_id); profile_id is None if another profile was running or
+    one was taken too recently, in which case the destination stays armed.
+    """
+    if not _claim(destination):
+        return func(*args), None
+    record = {
+        "id": uuid.uuid4().hex,
+        "destination": destination,
+        "started_at": time.time(),
+        "stages": {},
+        "sizes": {}
+    }
+    token = _current.set(record)
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    try:
+        profiler.enable()
+        try:
+            result = func(*args)
+        finally:
+            profiler.disable()
+    finally:
+        record["wall_ms"] = (time.perf_counter() - start) * 1000
+        _current.reset(token)
+        _profile_lock.release()
+
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+    record["profile"] = out.getvalue()
+    with _state_lock:
+        profiles[record["id"]] = record
+        while len(profiles) > PROFILE_MAX_STORED:
+            profiles.popitem(last=False)
+    logger.info(f"Stored profile {record['id']} for '{destination}' ({record['wall_ms']:.0f}ms)")
+    return result, record["id"]
+
+def list_profiles():
+    """Summaries of stored profiles, newest first."""
+    with _state_lock:
+        return [{k: v for k, v in record.items() if k != "profile"} for record in reversed(profiles.values())]
+
+def get_profile(profile_id):
+    with _state_lock:
+        return profiles.get(profile_id)
@@ -1,22 +1,302 @@
 import os
+import random
+import hashlib
+import threading
+from collections import OrderedDict
 import numpy as np
 from dotenv import load_dotenv
 import openrouteservice
+from openrouteservice import exceptions as ors_exceptions
+import requests
 import time
 from sklearn.cluster import DBSCAN, AgglomerativeClustering
 from sklearn.neighbors import NearestNeighbors
 import logging
+import ors_recorder
+import cache_metrics
 
 # Load environment variables
 load_dotenv()
 ORS_API_KEY = os.getenv("ORS_API_KEY")
-if not ORS_API_KEY:
+if not ORS_API_KEY and ors_recorder.MODE != "replay":
     raise ValueError("ORS_API_KEY not found in .env file")
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Routing scheduler settings (ORS free tier: 40 matrix requests/minute, 3500 elements per request)
+ORS_RATE_PER_MINUTE = float(os.getenv("ORS_RATE_PER_MINUTE", "40"))
+ORS_BURST = int(os.getenv("ORS_BURST", "5"))
+ORS_BATCH_WINDOW = float(os.getenv("ORS_BATCH_WINDOW", "0.05"))  # seconds
+ORS_MAX_MATRIX_ELEMENTS = int(os.getenv("ORS_MAX_MATRIX_ELEMENTS", "3500"))
+ORS_MAX_RETRIES = int(os.getenv("ORS_MAX_RETRIES", "4"))
+ORS_BACKOFF_BASE = float(os.getenv("ORS_BACKOFF_BASE", "1.0"))  # seconds
+ORS_RETRY_DEADLINE = float(os.getenv("ORS_RETRY_DEADLINE", "30"))  # seconds across all attempts of one call
+
+# CPU time (thread time) the intra-day route optimizer may spend per itinerary request
+ROUTE_OPT_BUDGET_MS = float(os.getenv("ROUTE_OPT_BUDGET_MS", "20"))
+ROUTE_OPT_NN_STARTS = int(os.getenv("ROUTE_OPT_NN_STARTS", "8"))
+
+# Raw ORS matrices and cluster labels of recent requests (both expire after MATRIX_CACHE_TTL)
+MATRIX_CACHE_TTL = float(os.getenv("MATRIX_CACHE_TTL", "3600"))
+MATRIX_CACHE_SIZE = int(os.getenv("MATRIX_CACHE_SIZE", "512"))
+CLUSTER_CACHE_SIZE = int(os.getenv("CLUSTER_CACHE_SIZE", "512"))
+_matrix_cache = OrderedDict()
+_cluster_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class TokenBucket:
+    """Thread-safe token bucket used to pace outgoing ORS calls."""
+
+    def __init__(self, rate_per_second, capacity):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available, then consume it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class _MatrixBatch:
+    """Coordinates of all pending requests merged into a single ORS matrix call."""
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.coords = []
+        self.index = {}
+        self.keys = []
+        self.done = threading.Event()
+        self.distances = None
+        self.durations = None
+        self.error = None
+
+    def fits(self, coords, max_elements):
+        new = len(set(coords) - self.index.keys())
+        return (len(self.coords) + new) ** 2 <= max_elements
+
+    def add(self, coords):
+        for coord in coords:
+            if coord not in self.index:
+                self.index[coord] = len(self.coords)
+                self.coords.append(coord)
+
+
+class RoutingScheduler:
+    """
+    Shares ORS matrix calls between concurrent requests.
+
+    - Identical in-flight requests (same profile and coordinates) wait on a single call.
+    - Requests for the same profile arriving within the batching window are merged into
+      one larger matrix call, as long as it stays within the ORS element limit. The window
+      is only waited for while other matrix calls are in flight.
+    - Outgoing calls are paced by a token bucket and retried with exponential backoff
+      on rate limiting, timeouts and server errors, within retry_deadline seconds.
+    """
+
+    def __init__(self, client, rate_per_minute=ORS_RATE_PER_MINUTE, burst=ORS_BURST,
+                 batch_window=ORS_BATCH_WINDOW, max_elements=ORS_MAX_MATRIX_ELEMENTS,
+                 max_retries=ORS_MAX_RETRIES, backoff_base=ORS_BACKOFF_BASE, retry_deadline=ORS_RETRY_DEADLINE):
+        self.client = client
+        self.bucket = TokenBucket(rate_per_minute / 60.0, burst)
+        self.batch_window = batch_window
+        self.max_elements = max_elements
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.retry_deadline = retry_deadline
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.open_batches = {}
+
+    def fetch(self, coords, profile):
+        """
+        Return (distances, durations) for coords as NumPy arrays (km, seconds),
+        sharing the underlying ORS call with concurrent requests where possible.
+        """
+        key = (profile, tuple(coords))
+        leader = False
+        with self.lock:
+            batch = self.inflight.get(key)
+            if batch is None:
+                batch = self.open_batches.get(profile)
+                if batch is None or not batch.fits(coords, self.max_elements):
+                    batch = _MatrixBatch(profile)
+                    self.open_batches[profile] = batch
+                    leader = True
+                batch.add(coords)
+                batch.keys.append(key)
+                self.inflight[key] = batch
+            else:
+                logger.info(f"Joining in-flight ORS matrix request for {len(coords)} locations")
+
+        if leader:
+            self._run(batch)
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        idx = [batch.index[coord] for coord in coords]
+        return batch.distances[np.ix_(idx, idx)], batch.durations[np.ix_(idx, idx)]
+
+    def _run(self, batch):
+        with self.lock:
+            busy = any(other is not batch for other in self.inflight.values())
+        # Without concurrent traffic there is nothing to merge with, so skip the window
+        if busy:
+            time.sleep(self.batch_window)
+        with self.lock:
+            if self.open_batches.get(batch.profile) is batch:
+                del self.open_batches[batch.profile]
+        try:
+            if len(batch.keys) > 1:
+                logger.info(f"Merged {len(batch.keys)} requests into one ORS matrix call for {len(batch.coords)} locations")
+            result = self._call_with_retry(batch.coords, batch.profile)
+            if "distances" not in result or "durations" not in result:
+                raise ValueError("ORS response missing distances or durations.")
+            batch.distances = np.array(result["distances"], dtype=np.float32)
+            batch.durations = np.array(result["durations"], dtype=np.float32)
+        except Exception as e:
+            batch.error = e
+        finally:
+            with self.lock:
+                for key in batch.keys:
+                    if self.inflight.get(key) is batch:
+                        del self.inflight[key]
+            batch.done.set()
+
+    def _call_with_retry(self, coords, profile):
+        deadline = time.monotonic() + self.retry_deadline
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            try:
+                return self.client.distance_matrix(
+                    locations=coords,
+                    profile=profile,
+                    metrics=["distance", "duration"],
+                    resolve_locations=False,
+                    units="km"
+                )
+            except Exception as e:
+                if attempt == self.max_retries or not _is_retryable(e):
+                    logger.error(f"ORS Matrix API failed: {e}")
+                    raise
+                delay = self.backoff_base * (2 ** attempt) * (1 + random.random())
+                if time.monotonic() + delay > deadline:
+                    logger.error(f"ORS Matrix API failed: {e} (giving up after {self.retry_deadline:.0f}s)")
+                    raise
+                logger.warning(f"ORS Matrix API failed ({e}), retrying in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries})")
+                time.sleep(delay)
+
+
+def _is_retryable(error):
+    """Rate limiting, timeouts, connection problems and server errors are worth retrying."""
+    if isinstance(error, ors_exceptions.ApiError):
+        return error.status == 429 or (isinstance(error.status, int) and error.status >= 500)
+    if isinstance(error, ors_exceptions.HTTPError):
+        return error.status_code >= 500
+    return isinstance(error, (ors_exceptions.Timeout, requests.exceptions.ConnectionError))
+
+
+# Replay mode runs without network access or an API key; retries are left to the scheduler
+scheduler = RoutingScheduler(openrouteservice.Client(key=ORS_API_KEY, retry_timeout=0, retry_over_query_limit=False)) if ORS_API_KEY else None
+
+def _cache_get(cache, key, name):
+    """Return a fresh cached value (None on a miss), counting the lookup."""
+    with _cache_lock:
+        cached = cache.get(key)
+        if cached is not None and cache_metrics.is_fresh(time.time() - cached[0], MATRIX_CACHE_TTL):
+            cache.move_to_end(key)
+            cache_metrics.record(name, hit=True)
+            return cached[1]
+    cache_metrics.record(name, hit=False)
+    return None
+
+def _cache_put(cache, key, value, max_size):
+    with _cache_lock:
+        cache[key] = (time.time(), value)
+        cache.move_to_end(key)
+        while len(cache) > max_size:
+            cache.popitem(last=False)
+
+def sanitize_matrix(matrix, nan_value, inf_value=None, atol=0.0, name="input"):
+    """
+    Replace NaN/inf, symmetrize and validate a square matrix in one fused pass.
+    
+    The matrix is converted to float32 once (no copy if it already is) and modified in place.
+    
+    Parameters:
+    - matrix: square array-like, None entries are treated as NaN.
+    - nan_value: value replacing NaN entries.
+    - inf_value: value replacing inf entries (default: 10x the largest finite value).
+    - atol: asymmetry tolerance; above it the matrix is averaged with its transpose.
+    - name: matrix name used in log messages.
+    
+    Returns:
+    - tuple: (matrix, report) with the float32 matrix and a dict of nan/inf counts,
+      per-row NaN counts, largest finite value and max asymmetry.
+    """
+    m = np.asarray(matrix, dtype=np.float32)
+    if m.ndim != 2 or m.shape[0] != m.shape[1]:
+        raise ValueError(f"{name.capitalize()} matrix must be square, got shape {m.shape}")
+    n = m.shape[0]
+    
+    # Single scan for non-finite entries; NaN/inf are told apart only on the (few) bad entries
+    bad_rows, bad_cols = np.nonzero(~np.isfinite(m))
+    bad_values = m[bad_rows, bad_cols]
+    is_nan = np.isnan(bad_values)
+    row_nan_counts = np.bincount(bad_rows[is_nan], minlength=n)
+    n_nan = int(is_nan.sum())
+    n_inf = len(bad_values) - n_nan
+    if len(bad_values) == m.size and m.size:
+        raise ValueError(f"{name.capitalize()} matrix has no finite values")
+    
+    if n_nan:
+        m[bad_rows[is_nan], bad_cols[is_nan]] = nan_value
+        logger.warning(f"Replaced {n_nan} NaN values in {name} matrix ({np.count_nonzero(row_nan_counts)} of {n} rows affected) with {nan_value}")
+    if n_inf:
+        inf_rows, inf_cols = bad_rows[~is_nan], bad_cols[~is_nan]
+        m[inf_rows, inf_cols] = -np.inf
+        max_finite = float(m.max())
+        m[inf_rows, inf_cols] = inf_value if inf_value else max_finite * 10
+        logger.warning(f"Replaced {n_inf} inf values in {name} matrix with {m[inf_rows[0], inf_cols[0]]}")
+    else:
+        max_finite = float(m.max()) if m.size else 0.0
+    
+    # Symmetrize with a single temporary: m - (m - m.T) / 2 == (m + m.T) / 2
+    diff = m - m.T
+    max_asymmetry = float(max(diff.max(), -diff.min())) if m.size else 0.0
+    if max_asymmetry > atol:
+        logger.warning(f"{name.capitalize()} matrix is asymmetric (max difference {max_asymmetry:.6f}). Symmetrizing by averaging.")
+        diff *= 0.5
+        m -= diff
+    del diff
+    
+    if m.size and m.min() < 0:
+        raise ValueError(f"{name.capitalize()} matrix contains negative values")
+    
+    report = {
+        "nan": n_nan,
+        "inf": n_inf,
+        "row_nan_counts": row_nan_counts,
+        "max_finite": max_finite,
+        "max_asymmetry": max_asymmetry
+    }
+    return m, report
+
 def fetch_distance_matrix(locations, profile='driving-car'):
     """
     Fetch distance and time matrices using OpenRouteService API.
@@ -41,95 +321,44 @@ def fetch_distance_matrix(locations, profile='driving-car'):
     n = len(coords)
     logger.info(f"Fetching distance matrix for {n} locations using ORS ({profile})...")
     
-    client = openrouteservice.Client(key=ORS_API_KEY)
-    try:
-        result = client.distance_matrix(
-            locations=coords,
-            profile=profile,
-            metrics=["distance", "duration"],
-            resolve_locations=False,
-            units="km"
-        )
-    except Exception as e:
-        logger.error(f"ORS Matrix API failed: {e}")
-        raise
-    
-    # Parse result
-    if "distances" not in result or "durations" not in result:
-        raise ValueError("ORS response missing distances or durations.")
+    key = (profile, tuple(coords))
+    cached = _cache_get(_matrix_cache, key, "matrix")
+    if cached is not None:
+        distances, durations = cached[0].copy(), cached[1].copy()
+    else:
+        if ors_recorder.MODE == "replay":
+            distances, durations = ors_recorder.replay(coords, profile)
+        else:
+            distances, durations = scheduler.fetch(coords, profile)
+            if ors_recorder.MODE == "record":
+                ors_recorder.record(coords, profile, distances, durations)
+        _cache_put(_matrix_cache, key, (distances.copy(), durations.copy()), MATRIX_CACHE_SIZE)
     
-    # Convert to NumPy arrays
-    distance_matrix = np.array(result["distances"], dtype=float)  # km
-    time_matrix = np.array(result["durations"], dtype=float) / 3600  # hours
+    # Replace NaN/inf and symmetrize in place (float32, km and hours)
+    time_matrix = np.asarray(durations, dtype=np.float32)
+    time_matrix /= 3600
+    distance_matrix, dist_report = sanitize_matrix(distances, nan_value=1000.0, atol=0.1, name="distance")  # 1000 km
+    time_matrix, time_report = sanitize_matrix(time_matrix, nan_value=10.0, atol=0.1/3600, name="time")  # 10 hours
     
     # Identify problematic locations (those with too many NaNs)
-    nan_dist_counts = np.sum(np.isnan(distance_matrix), axis=1)
-    nan_time_counts = np.sum(np.isnan(time_matrix), axis=1)
     nan_threshold = n // 2  # Exclude locations with NaNs in over half the entries
-    valid_indices = [i for i in range(n) if nan_dist_counts[i] <= nan_threshold and nan_time_counts[i] <= nan_threshold]
+    valid_mask = (dist_report["row_nan_counts"] <= nan_threshold) & (time_report["row_nan_counts"] <= nan_threshold)
+    valid_indices = np.flatnonzero(valid_mask).tolist()
     
     if not valid_indices:
         raise ValueError("No valid locations after NaN filtering")
     
     if len(valid_indices) < n:
-        logger.warning(f"Excluding {n - len(valid_indices)} locations due to excessive NaN values")
-        for i in range(n):
-            if i not in valid_indices:
-                logger.warning(f"Excluded location {coords[i]} with {nan_dist_counts[i]} NaN distances and {nan_time_counts[i]} NaN times")
+        excluded = np.flatnonzero(~valid_mask)
+        logger.warning(f"Excluding {len(excluded)} locations due to excessive NaN values, e.g. {[coords[i] for i in excluded[:5]]}")
         distance_matrix = distance_matrix[np.ix_(valid_indices, valid_indices)]
         time_matrix = time_matrix[np.ix_(valid_indices, valid_indices)]
     
-    # Log NaN locations for remaining matrix
-    nan_dist_indices = np.where(np.isnan(distance_matrix))
-    for i, j in zip(nan_dist_indices[0], nan_dist_indices[1]):
-        logger.warning(f"NaN distance between {coords[valid_indices[i]]} and {coords[valid_indices[j]]}")
-    nan_time_indices = np.where(np.isnan(time_matrix))
-    for i, j in zip(nan_time_indices[0], nan_time_indices[1]):
-        logger.warning(f"NaN time between {coords[valid_indices[i]]} and {coords[valid_indices[j]]}")
-    
-    # Replace None and NaN with large finite values
-    distance_matrix[distance_matrix == None] = 1000.0  # 1000 km
-    time_matrix[time_matrix == None] = 10.0  # 10 hours
-    if np.any(np.isnan(distance_matrix)):
-        logger.warning(f"Found {np.sum(np.isnan(distance_matrix))} NaN values in distance matrix. Replacing with 1000 km.")
-        distance_matrix[np.isnan(distance_matrix)] = 1000.0
-    if np.any(np.isnan(time_matrix)):
-        logger.warning(f"Found {np.sum(np.isnan(time_matrix))} NaN values in time matrix. Replacing with 10 hours.")
-        time_matrix[np.isnan(time_matrix)] = 10.0
-    
-    # Log matrix statistics for debugging
     logger.info(f"Distance matrix shape: {distance_matrix.shape}")
-    logger.info(f"Contains NaN: {np.any(np.isnan(distance_matrix))}")
-    logger.info(f"Contains inf: {np.any(np.isinf(distance_matrix))}")
-    
-    # Check for asymmetry and symmetrize
-    if not np.allclose(distance_matrix, distance_matrix.T, atol=0.1, equal_nan=True):
-        logger.warning("Distance matrix is asymmetric. Symmetrizing by averaging.")
-        distance_matrix = (distance_matrix + distance_matrix.T) / 2
-        distance_matrix[np.isnan(distance_matrix)] = 1000.0
-        diff = np.abs(distance_matrix - distance_matrix.T)
-        finite_diff = diff[np.isfinite(diff)]
-        max_diff = np.max(finite_diff) if len(finite_diff) > 0 else 0
-        logger.info(f"Max asymmetry in distance matrix: {max_diff:.2f} km")
-    
-    if not np.allclose(time_matrix, time_matrix.T, atol=0.1/3600, equal_nan=True):
-        logger.warning("Time matrix is asymmetric. Symmetrizing by averaging.")
-        time_matrix = (time_matrix + time_matrix.T) / 2
-        time_matrix[np.isnan(time_matrix)] = 10.0
-        diff = np.abs(time_matrix - time_matrix.T)
-        finite_diff = diff[np.isfinite(diff)]
-        max_diff = np.max(finite_diff) if len(finite_diff) > 0 else 0
-        logger.info(f"Max asymmetry in time matrix: {max_diff*3600:.2f} seconds")
-    
-    # Ensure non-negative
-    if np.any(distance_matrix < 0):
-        raise ValueError("Distance matrix contains negative values")
-    if np.any(time_matrix < 0):
-        raise ValueError("Time matrix contains negative values")
     
     return distance_matrix, time_matrix, valid_indices
 
-def cluster_locations(distance_matrix, locations=None, eps_km=None, min_samples=2, method='dbscan', max_distance=None):
+def cluster_locations(distance_matrix, locations=None, eps_km=None, min_samples=2, method='dbscan', max_distance=None, sanitized=False):
     """
     Cluster locations based on distance matrix.
     
@@ -140,44 +369,31 @@ def cluster_locations(distance_matrix, locations=None, eps_km=None, min_samples=
     - min_samples: Minimum points per cluster.
     - method: Clustering method ('dbscan' or 'hierarchical').
     - max_distance: Distance to replace inf values.
+    - sanitized: Skip validation for matrices already passed through sanitize_matrix.
     
     Returns:
     - clusters: Array of cluster labels.
     """
-    # Validate distance matrix
-    dist_array = np.array(distance_matrix)
-    
-    # Log matrix statistics
+    # Validate distance matrix (already clean when it comes from fetch_distance_matrix)
+    if sanitized:
+        dist_array = np.asarray(distance_matrix)
+        max_finite = float(dist_array.max()) if dist_array.size else 100.0
+    else:
+        dist_array, report = sanitize_matrix(distance_matrix, nan_value=1000.0, inf_value=max_distance, atol=1e-2, name="distance")
+        max_finite = report["max_finite"]
     logger.info(f"Clustering distance matrix shape: {dist_array.shape}")
-    logger.info(f"Contains NaN: {np.any(np.isnan(dist_array))}")
-    logger.info(f"Contains inf: {np.any(np.isinf(dist_array))}")
-    
-    # Replace NaN with large finite value
-    if np.any(np.isnan(dist_array)):
-        logger.warning(f"Found {np.sum(np.isnan(dist_array))} NaN values in distance matrix. Replacing with 1000 km.")
-        dist_array[np.isnan(dist_array)] = 1000.0
-    
-    # Relaxed symmetry check with higher tolerance
-    if not np.allclose(dist_array, dist_array.T, atol=1e-2, equal_nan=True):
-        logger.warning("Distance matrix is not symmetric. Forcing symmetry.")
-        dist_array = (dist_array + dist_array.T) / 2
-        dist_array[np.isnan(dist_array)] = 1000.0
-        diff = np.abs(dist_array - dist_array.T)
-        finite_diff = diff[np.isfinite(diff)]
-        max_diff = np.max(finite_diff) if len(finite_diff) > 0 else 0
-        logger.info(f"Forced symmetrization max difference: {max_diff:.6f} km")
-    
-    if np.any(dist_array < 0):
-        raise ValueError("Distance matrix contains negative values")
-    
-    # Handle unreachable points
-    finite_distances = dist_array[np.isfinite(dist_array)]
-    if len(finite_distances) == 0:
-        raise ValueError("Distance matrix has no finite distances")
-    max_finite = np.max(finite_distances) if len(finite_distances) > 0 else 100
-    inf_replacement = max_distance if max_distance else max_finite * 10
-    dist_array[np.isinf(dist_array)] = inf_replacement
     
+    # Identical matrices (same stops) reuse their labels
+    key = (hashlib.sha1(dist_array.tobytes()).hexdigest(), dist_array.shape, eps_km, min_samples, method)
+    cached = _cache_get(_cluster_cache, key, "clusters")
+    if cached is not None:
+        return cached.copy()
+    clusters = _fit_clusters(dist_array, locations, eps_km, min_samples, method, max_finite)
+    _cache_put(_cluster_cache, key, clusters.copy(), CLUSTER_CACHE_SIZE)
+    return clusters
+
+def _fit_clusters(dist_array, locations, eps_km, min_samples, method, max_finite):
+    """Fit cluster labels on a sanitized distance matrix."""
     # Auto-estimate eps if not provided (for DBSCAN)
     if method == 'dbscan' and eps_km is None:
         if dist_array.shape[0] < min_samples:
@@ -251,4 +467,73 @@ def cluster_locations(distance_matrix, locations=None, eps_km=None, min_samples=
     logger.info(f"Noise points (unclustered): {n_noise}")
     logger.info(f"Average intra-cluster distance: {avg_intra_distance:.2f} km")
 
-    return clusters
\ No newline at end of file
+    return clusters
+
+def _path_cost(sub, order):
+    return float(sub[order[:-1], order[1:]].sum())
+
+def order_stops(time_matrix, indices, deadline=None):
+    """
+    Order stops to minimise the total travel time of an open path (anytime).
+    
+    Nearest-neighbour paths are built from up to ROUTE_OPT_NN_STARTS starts, then the best one is improved
+    with 2-opt moves. Once the thread CPU time passes the deadline (time.thread_time()
+    value) the best plan found so far is returned; at least one full path is always built.
+    
+    Parameters:
+    - time_matrix: NumPy array of travel times (hours).
+    - indices: matrix indices of the stops.
+    - deadline: optional time.thread_time() deadline.
+    
+    Returns:
+    - tuple: (order, travel_time) with order as positions into indices.
+    """
+    n = len(indices)
+    if n < 2:
+        return list(range(n)), 0.0
+    sub = np.asarray(time_matrix, dtype=np.float64)[np.ix_(indices, indices)]
+    
+    def out_of_time():
+        return deadline is not None and time.thread_time() > deadline
+    
+    # Vectorized nearest-neighbour construction, leaving most of the budget to 2-opt on long routes
+    best_order, best_cost = None, np.inf
+    for start in range(min(n, ROUTE_OPT_NN_STARTS)):
+        order = [start]
+        visited = np.zeros(n, dtype=bool)
+        visited[start] = True
+        for _ in range(n - 1):
+            nxt = int(np.argmin(np.where(visited, np.inf, sub[order[-1]])))
+            order.append(nxt)
+            visited[nxt] = True
+        order = np.array(order)
+        cost = _path_cost(sub, order)
+        if cost < best_cost:
+            best_order, best_cost = order, cost
+        if out_of_time():
+            break
+    
+    # 2-opt: reverse order[i..j], scoring all j for a given i at once
+    order = best_order
+    improved = True
+    while improved and not out_of_time():
+        improved = False
+        for i in range(n - 1):
+            j = np.arange(i + 1, n)
+            has_next = j < n - 1
+            delta = np.zeros(len(j))
+            if i > 0:
+                delta += sub[order[i - 1], order[j]] - sub[order[i - 1], order[i]]
+            delta[has_next] += sub[order[i], order[j[has_next] + 1]] - sub[order[j[has_next]], order[j[has_next] + 1]]
+            k = int(np.argmin(delta))
+            if delta[k] < -1e-9:
+                candidate = order.copy()
+                candidate[i:j[k] + 1] = candidate[i:j[k] + 1][::-1]
+                # The delta assumes symmetric legs; keep the move only if the real cost drops
+                cost = _path_cost(sub, candidate)
+                if cost < best_cost - 1e-9:
+                    order, best_cost = candidate, cost
+                    improved = True
+            if out_of_time():
+                break
+    return order.tolist(), best_cost
@@ -0,0 +1,140 @@
+#Background refresh-ahead warming of the caches behind the most requested destinations
+
+import os
+import json
+import time
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+import cache_metrics
+from Similarity_Algorithm import load_destination_spots
+from Itinerary_Generator import prepare_trip, resolve_variants
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+WARMER_ENABLED = os.getenv("WARMER_ENABLED", "1") == "1"
+WARMER_INTERVAL = float(os.getenv("WARMER_INTERVAL", "30"))  # seconds between warming cycles
+WARMER_TOP_DESTINATIONS = int(os.getenv("WARMER_TOP_DESTINATIONS", "5"))
+WARMER_SHAPES_PER_DESTINATION = int(os.getenv("WARMER_SHAPES_PER_DESTINATION", "3"))
+WARMER_CONCURRENCY = int(os.getenv("WARMER_CONCURRENCY", "1"))
+WARMER_CYCLE_BUDGET = float(os.getenv("WARMER_CYCLE_BUDGET", "10"))  # seconds of warming work per cycle
+WARMER_MAX_FOREGROUND = int(os.getenv("WARMER_MAX_FOREGROUND", "1"))  # no new warming work while this many requests run
+WARMER_HALF_LIFE = float(os.getenv("WARMER_HALF_LIFE", "600"))  # seconds for request counts to decay by half
+
+_lock = threading.Lock()
+_popularity = {}  # destination -> (decayed request count, updated at)
+_shapes = {}      # destination -> recent distinct trip inputs
+_foreground = 0
+_thread = None
+_slots = threading.Semaphore(WARMER_CONCURRENCY)  # shared by all cycles, so slow workers count against later ones
+stats = Counter()
+
+def _decayed(score, updated_at, now):
+    return score * 0.5 ** ((now - updated_at) / WARMER_HALF_LIFE)
+
+def record_request(user_input):
+    """Count a request for its destination and remember its trip shape for warming."""
+    try:
+        trip = dict(user_input["trip"])
+        destination = str(trip["destination"]).lower().strip()
+    except (KeyError, TypeError, ValueError):
+        return
+    now = time.time()
+    with _lock:
+        score, updated_at = _popularity.get(destination, (0.0, now))
+        _popularity[destination] = (_decayed(score, updated_at, now) + 1, now)
+        shapes = _shapes.setdefault(destination, deque(maxlen=WARMER_SHAPES_PER_DESTINATION))
+        key = json.dumps(trip, sort_keys=True, default=str)
+        if all(json.dumps(s, sort_keys=True, default=str) != key for s in shapes):
+            shapes.append(trip)
+
+@contextmanager
+def foreground():
+    """Mark a foreground request as in flight; the warmer backs off while requests run."""
+    global _foreground
+    with _lock:
+        _foreground += 1
+    try:
+        yield
+    finally:
+        with _lock:
+            _foreground -= 1
+
+def top_destinations(limit=WARMER_TOP_DESTINATIONS):
+    now = time.time()
+    with _lock:
+        ranked = sorted(((_decayed(score, updated_at, now), dest) for dest, (score, updated_at) in _popularity.items()), reverse=True)
+    return [(dest, round(score, 2)) for score, dest in ranked[:limit]]
+
+def _warm(destination, shapes):
+    """Refresh the spot catalog, distance matrices and clusters of a destination that are close to expiry (no hotel lookup)."""
+    start = time.time()
+    try:
+        with cache_metrics.warming():
+            load_destination_spots(destination)
+            for trip in shapes:
+                # Variant requests fetch candidates for their largest variant budget
+                variants = resolve_variants(trip)
+                prepare_trip({"trip": trip}, max(v["budget"] for v in variants) if variants else None, warm_only=True)
+        stats["destinations_warmed"] += 1
+    except Exception as e:
+        stats["errors"] += 1
+        logger.warning(f"Warming '{destination}' failed: {e}")
+    finally:
+        stats["busy_seconds"] += time.time() - start
+
+def run_cycle():
+    """Warm the hottest destinations, with bounded concurrency and within the cycle budget."""
+    deadline = time.monotonic() + WARMER_CYCLE_BUDGET
+    workers = []
+    stats["cycles"] += 1
+    for destination, _ in top_destinations():
+        # Wait for a free slot and for foreground traffic to calm down, within the budget
+        while time.monotonic() < deadline and (_foreground >= WARMER_MAX_FOREGROUND or not _slots.acquire(timeout=0.1)):
+            time.sleep(0.1)
+        if time.monotonic() >= deadline:
+            stats["budget_exhausted"] += 1
+            break
+        with _lock:
+            shapes = list(_shapes.get(destination, ()))
+
+        def work(destination=destination, shapes=shapes):
+            try:
+                _warm(destination, shapes)
+            finally:
+                _slots.release()
+
+        worker = threading.Thread(target=work, name=f"warm-{destination}", daemon=True)
+        worker.start()
+        workers.append(worker)
+    for worker in workers:
+        worker.join(max(0.0, deadline - time.monotonic()))
+
+def _loop():
+    while True:
+        time.sleep(WARMER_INTERVAL)
+        try:
+            run_cycle()
+        except Exception as e:
+            logger.error(f"Warmer cycle failed: {e}")
+
+def start():
+    """Start the background warmer thread once (no-op when WARMER_ENABLED is off)."""
+    global _thread
+    if not WARMER_ENABLED or _thread is not None:
+        return
+    _thread = threading.Thread(target=_loop, name="cache-warmer", daemon=True)
+    _thread.start()
+    logger.info(f"Cache warmer started (every {WARMER_INTERVAL:.0f}s, top {WARMER_TOP_DESTINATIONS} destinations)")
+
+def status():
+    """Warmer activity and the destinations it currently keeps warm."""
+    return {
+        "enabled": WARMER_ENABLED,
+        "running": _thread is not None,
+        "foreground_in_flight": _foreground,
+        "top_destinations": top_destinations(),
+        "stats": {k: round(v, 3) if isinstance(v, float) else v for k, v in stats.items()}
+    }